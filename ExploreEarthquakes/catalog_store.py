@@ -0,0 +1,487 @@
+# encoding: utf-8
+# Local earthquake catalogue store for EI LIVE 2020 (ExploreEarthquakes):
+# Instead of pulling the catalogue again for every page and pre-rendering it at one resolution
+# (output/a1_global_seismicity.html, a2_global_seismicity_heatmap.html, ...), the events are kept
+# in a columnar store (one .npy file per column, memory-mapped) sorted by a grid of lat/lon cells,
+# so a region is a handful of contiguous slices. A Bokeh server app re-aggregates the events in
+# view at screen resolution on every zoom (with datashader if it is installed, numpy otherwise) and
+# shows the Gutenberg-Richter and magnitude-depth statistics of the selected region.
+#
+#     python catalog_store.py fetch 1976-01-01 2020-06-01 store --minmagnitude 5  # USGS ComCat
+#     python catalog_store.py build catalog.csv store                            # or a saved csv
+#     python catalog_store.py serve store                                        # http://localhost:5006
+#
+#     import catalog_store
+#     store = catalog_store.CatalogStore('store')
+#     idx = store.select(lon=(130, 150), lat=(30, 46), mag=(5, 10))
+#     catalog_store.gutenberg_richter(store.get(idx)['mag'])
+#
+import json
+import os
+
+
+USGS_URL = "https://earthquake.usgs.gov/fdsnws/event/1/query"
+
+# Numeric columns of the store and their types
+COLUMNS = {'time': 'datetime64[ns]', 'latitude': 'float64', 'longitude': 'float64',
+           'depth': 'float32', 'mag': 'float32'}
+
+
+def fetch_usgs(starttime, endtime, minmagnitude=5., step_days=365, cache_dir=None, url=USGS_URL):
+    """
+    Download the USGS ComCat catalogue between starttime and endtime in chunks of step_days
+    (a query returns at most 20000 events), keeping each chunk as a csv in cache_dir if given.
+    Returns a DataFrame with the usual ComCat columns (time, latitude, longitude, depth, mag, place, ...).
+
+    """
+    import io
+    import pandas as pd
+
+    edges = list(pd.date_range(starttime, endtime, freq='%dD' % step_days))
+    if edges[-1] < pd.Timestamp(endtime):
+        edges.append(pd.Timestamp(endtime))
+    dfs = []
+    for t0, t1 in zip(edges[:-1], edges[1:]):
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, 'usgs_M%g_%s_%s.csv' % (minmagnitude, t0.strftime('%Y%m%d'),
+                                                                   t1.strftime('%Y%m%d')))
+        if path is not None and os.path.isfile(path):
+            dfs.append(pd.read_csv(path))
+            continue
+        import requests
+        response = requests.get(url, params=dict(format='csv', starttime=t0.isoformat(), endtime=t1.isoformat(),
+                                                 minmagnitude=minmagnitude, orderby='time-asc'))
+        response.raise_for_status()
+        dfs.append(pd.read_csv(io.StringIO(response.text)))
+        if path is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(path + '.tmp', 'w') as f:
+                f.write(response.text)
+            os.replace(path + '.tmp', path)
+    df = pd.concat(dfs, ignore_index=True)
+    if 'id' in df.columns:
+        df = df.drop_duplicates('id')
+    return df
+
+
+def build_store(df, store_dir, cell_deg=1.):
+    """
+    Write the events of df (columns time, latitude, longitude, depth, mag and optionally place)
+    to store_dir: one .npy file per column, with the rows sorted by grid cell (cell_deg x cell_deg,
+    row-major from the south-west corner) and by time within a cell, cell_start.npy with the first
+    row of every cell, counts.npy with the number of events per cell, and meta.json.
+    Returns the CatalogStore.
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    df = df.dropna(subset=['latitude', 'longitude', 'mag'])
+    time = pd.to_datetime(df['time'], utc=True).dt.tz_localize(None).values.astype('datetime64[ns]')
+    lat = df['latitude'].values.astype(np.float64)
+    lon = ((df['longitude'].values.astype(np.float64) + 180.) % 360.) - 180.
+    nlat, nlon = int(np.ceil(180./cell_deg)), int(np.ceil(360./cell_deg))
+    cell = (np.clip(((lat + 90.)/cell_deg).astype(int), 0, nlat-1)*nlon
+            + np.clip(((lon + 180.)/cell_deg).astype(int), 0, nlon-1))
+    order = np.lexsort((time, cell))
+
+    columns = dict(time=time, latitude=lat, longitude=lon, depth=df['depth'].fillna(0).values, mag=df['mag'].values)
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(store_dir, name + '.npy'), np.asarray(columns[name])[order].astype(dtype))
+    if 'place' in df.columns:
+        # Variable length text as one utf-8 byte array plus offsets, so it stays memory-mappable
+        places = [str(p).encode('utf-8') if isinstance(p, str) else b'' for p in df['place'].values[order]]
+        offsets = np.zeros(len(places)+1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in places])
+        np.save(os.path.join(store_dir, 'place_bytes.npy'), np.frombuffer(b''.join(places), dtype=np.uint8))
+        np.save(os.path.join(store_dir, 'place_offsets.npy'), offsets)
+    cell_start = np.searchsorted(cell[order], np.arange(nlat*nlon+1))
+    np.save(os.path.join(store_dir, 'cell_start.npy'), cell_start)
+    np.save(os.path.join(store_dir, 'counts.npy'), np.diff(cell_start).reshape(nlat, nlon).astype(np.int32))
+
+    meta = dict(n=int(len(order)), cell_deg=float(cell_deg), nlat=nlat, nlon=nlon,
+                time=[str(time.min()), str(time.max())] if len(time) else [None, None],
+                mag=[float(np.nanmin(columns['mag'])), float(np.nanmax(columns['mag']))] if len(time) else [None, None],
+                depth=[float(np.nanmin(columns['depth'])), float(np.nanmax(columns['depth']))] if len(time) else [None, None],
+                place='place' in df.columns)
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return CatalogStore(store_dir)
+
+
+def read_catalog_csv(path):
+    """
+    Read a ComCat csv (as saved from the USGS search page or by fetch_usgs).
+
+    """
+    import pandas as pd
+
+    return pd.read_csv(path)
+
+
+class CatalogStore(object):
+    """
+    Columnar catalogue written by build_store. Columns are memory-mapped, so opening a store of
+    millions of events is instant and a query only reads the rows of the grid cells it covers.
+
+    """
+    def __init__(self, store_dir, mmap=True):
+        import numpy as np
+
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        self.columns = {name: np.load(os.path.join(store_dir, name + '.npy'), mmap_mode=mmap_mode)
+                        for name in COLUMNS}
+        self.cell_start = np.load(os.path.join(store_dir, 'cell_start.npy'))
+        self.counts = np.load(os.path.join(store_dir, 'counts.npy'))
+        if self.meta['place']:
+            self.place_bytes = np.load(os.path.join(store_dir, 'place_bytes.npy'), mmap_mode=mmap_mode)
+            self.place_offsets = np.load(os.path.join(store_dir, 'place_offsets.npy'), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return self.meta['n']
+
+    def _rows(self, lon, lat):
+        """
+        Rows of the grid cells overlapping lon x lat: one contiguous run of rows per row of cells.
+
+        """
+        import numpy as np
+
+        cell_deg, nlat, nlon = self.meta['cell_deg'], self.meta['nlat'], self.meta['nlon']
+        i0, i1 = [int(np.clip((v + 90.)//cell_deg, 0, nlat-1)) for v in lat]
+        j0, j1 = [int(np.clip((v + 180.)//cell_deg, 0, nlon-1)) for v in lon]
+        starts = self.cell_start[np.arange(i0, i1+1)*nlon + j0]
+        stops = self.cell_start[np.arange(i0, i1+1)*nlon + j1 + 1]
+        if j0 == 0 and j1 == nlon-1:
+            # full rows of cells are contiguous too
+            starts, stops = starts[:1], stops[-1:]
+        lengths = stops - starts
+        if lengths.sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+        # concatenated aranges without a python loop over cells
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return np.arange(lengths.sum()) + offsets
+
+    def select(self, lon=None, lat=None, time=None, mag=None, depth=None):
+        """
+        Indices of the events inside the given (min, max) ranges; None leaves a column unbounded.
+        time bounds may be anything numpy.datetime64 understands.
+
+        """
+        import numpy as np
+
+        lon = (-180., 180.) if lon is None else (max(lon[0], -180.), min(lon[1], 180.))
+        lat = (-90., 90.) if lat is None else (max(lat[0], -90.), min(lat[1], 90.))
+        if lon[0] > lon[1] or lat[0] > lat[1]:
+            return np.zeros(0, dtype=np.int64)
+        idx = self._rows(lon, lat)
+        ranges = [('longitude', lon), ('latitude', lat), ('mag', mag), ('depth', depth)]
+        if time is not None:
+            ranges.append(('time', tuple(np.datetime64(t, 'ns') for t in time)))
+        for name, bounds in ranges:
+            if bounds is None:
+                continue
+            values = self.columns[name][idx]
+            idx = idx[(values >= bounds[0]) & (values <= bounds[1])]
+        return idx
+
+    def get(self, idx, columns=None):
+        """
+        Dict of column arrays for the events idx.
+
+        """
+        return {name: self.columns[name][idx] for name in (columns if columns is not None else COLUMNS)}
+
+    def places(self, idx):
+        """
+        Place names of the events idx ('' if the store has none).
+
+        """
+        if not self.meta['place']:
+            return [''] * len(idx)
+        return [self.place_bytes[self.place_offsets[i]:self.place_offsets[i+1]].tobytes().decode('utf-8')
+                for i in idx]
+
+    def dataframe(self, idx, places=True):
+        """
+        The events idx as a DataFrame.
+
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(self.get(idx))
+        if places:
+            df['place'] = self.places(idx)
+        return df
+
+
+def aggregate_points(x, y, x_range, y_range, width, height, use_datashader=None):
+    """
+    Number of points per pixel of a width x height raster covering x_range x y_range (row 0 at
+    the bottom, as bokeh's image glyph expects). Uses datashader when it is installed (or
+    use_datashader=True), otherwise a vectorised numpy binning.
+
+    """
+    import numpy as np
+
+    if use_datashader is None or use_datashader:
+        try:
+            import datashader
+            import pandas as pd
+        except ImportError:
+            if use_datashader:
+                raise ImportError("use_datashader=True requires the datashader package (pip install datashader)")
+        else:
+            canvas = datashader.Canvas(plot_width=int(width), plot_height=int(height),
+                                       x_range=tuple(x_range), y_range=tuple(y_range))
+            agg = canvas.points(pd.DataFrame({'x': np.asarray(x), 'y': np.asarray(y)}), 'x', 'y',
+                                agg=datashader.count())
+            return agg.values.astype(np.int64)
+    x0, x1 = x_range
+    y0, y1 = y_range
+    ix = np.floor((np.asarray(x) - x0)/(x1 - x0)*width).astype(np.int64)
+    iy = np.floor((np.asarray(y) - y0)/(y1 - y0)*height).astype(np.int64)
+    # points on the top/right edges belong to the last pixel
+    ix[ix == width] = width - 1
+    iy[iy == height] = height - 1
+    keep = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+    return np.bincount(iy[keep]*width + ix[keep], minlength=width*height).reshape(height, width)
+
+
+def gutenberg_richter(mag, dm=0.1, mc=None):
+    """
+    Gutenberg-Richter statistics of the magnitudes mag: M (bin edges every dm), N (number of
+    events with magnitude >= M), the completeness magnitude mc (maximum curvature, i.e. the most
+    populated bin, unless given) and the maximum likelihood b value (Aki-Utsu, with its standard
+    error b/sqrt(n)) and a value of N = 10^(a - bM) for the events above mc.
+
+    """
+    import numpy as np
+
+    mag = np.asarray(mag, dtype=np.float64)
+    mag = mag[np.isfinite(mag)]
+    if len(mag) == 0:
+        return dict(M=np.zeros(0), N=np.zeros(0, dtype=np.int64), mc=np.nan, a=np.nan, b=np.nan, b_err=np.nan, n=0)
+    # bin on a grid of dm (rounded, so that e.g. 5.0 stays in the 5.0 bin)
+    k = np.round(mag/dm).astype(np.int64)
+    k0 = k.min()
+    hist = np.bincount(k - k0)
+    M = (k0 + np.arange(len(hist)))*dm
+    N = np.cumsum(hist[::-1])[::-1]
+    if mc is None:
+        mc = M[np.argmax(hist)]
+    above = mag[mag >= mc - dm/2.]
+    mean = above.mean() if len(above) else np.nan
+    b = np.log10(np.e)/(mean - (mc - dm/2.)) if len(above) > 1 and mean > mc - dm/2. else np.nan
+    a = np.log10(len(above)) + b*mc if len(above) else np.nan
+    return dict(M=M, N=N, mc=float(mc), a=float(a), b=float(b), b_err=float(b/np.sqrt(len(above))) if len(above) else np.nan,
+                n=int(len(above)))
+
+
+def mag_depth(mag, depth, mag_bins=None, depth_bins=None):
+    """
+    Magnitude-depth statistics: the 2D histogram (counts[depth_bin, mag_bin]) on mag_bins x depth_bins
+    (edges; 0.1 magnitude units and 10 km by default) and the median and 90th percentile depth of
+    the events in every magnitude bin.
+
+    """
+    import numpy as np
+
+    mag = np.asarray(mag, dtype=np.float64)
+    depth = np.asarray(depth, dtype=np.float64)
+    if mag_bins is None:
+        mag_bins = np.arange(np.floor(mag.min()*10)/10, np.ceil(mag.max()*10)/10 + 0.1, 0.1) if len(mag) else np.arange(0, 10.1, 0.1)
+    if depth_bins is None:
+        depth_bins = np.arange(0, (np.ceil(depth.max()/10) + 1)*10, 10.) if len(depth) else np.arange(0, 710, 10.)
+    counts, _, _ = np.histogram2d(depth, mag, bins=[depth_bins, mag_bins])
+    # Depth percentiles per magnitude bin, from the events sorted by bin then depth
+    ibin = np.clip(np.digitize(mag, mag_bins) - 1, 0, len(mag_bins)-2)
+    order = np.lexsort((depth, ibin))
+    starts = np.searchsorted(ibin[order], np.arange(len(mag_bins)))
+    sorted_depth = depth[order]
+    median = np.full(len(mag_bins)-1, np.nan)
+    p90 = np.full(len(mag_bins)-1, np.nan)
+    nonempty = starts[1:] > starts[:-1]
+    lo, hi = starts[:-1][nonempty], starts[1:][nonempty]
+    median[nonempty] = 0.5*(sorted_depth[lo + (hi-lo-1)//2] + sorted_depth[lo + (hi-lo)//2])
+    p90[nonempty] = sorted_depth[lo + ((hi-lo-1)*0.9).astype(np.int64)]
+    return dict(counts=counts, mag_edges=np.asarray(mag_bins), depth_edges=np.asarray(depth_bins),
+                mag_centers=0.5*(np.asarray(mag_bins)[1:] + np.asarray(mag_bins)[:-1]),
+                depth_median=median, depth_p90=p90)
+
+
+def catalog_app(store, plot_width=900, plot_height=450, max_points=5000, palette='Viridis256'):
+    """
+    Bokeh server application (a function of the document) exploring store: a density map of the
+    events in view, re-aggregated at screen resolution whenever the map is zoomed or panned or
+    the magnitude/depth/time sliders move, individual events (with hover) once at most max_points
+    are in view, and the Gutenberg-Richter and magnitude-depth plots of the selection.
+
+    """
+    def modify_doc(doc):
+        import numpy as np
+        import pandas as pd
+        import bokeh.models as bkm
+        from bokeh.plotting import figure
+        from bokeh.layouts import layout
+
+        meta = store.meta
+        tmin, tmax = [pd.Timestamp(t).to_pydatetime() for t in meta['time']]
+        mag_slider = bkm.RangeSlider(start=np.floor(meta['mag'][0]*10)/10, end=np.ceil(meta['mag'][1]*10)/10,
+                                     value=(np.floor(meta['mag'][0]*10)/10, np.ceil(meta['mag'][1]*10)/10),
+                                     step=0.1, title="Magnitude")
+        depth_slider = bkm.RangeSlider(start=min(0, np.floor(meta['depth'][0])), end=np.ceil(meta['depth'][1]),
+                                       value=(min(0, np.floor(meta['depth'][0])), np.ceil(meta['depth'][1])),
+                                       step=10, title="Depth (km)")
+        time_slider = bkm.DateRangeSlider(start=tmin, end=tmax, value=(tmin, tmax), title="Time")
+        stats = bkm.Div(text="")
+
+        # Density map, with single events drawn on top when few enough are in view
+        density = bkm.ColumnDataSource(data=dict(image=[np.full((1, 1), np.nan)], x=[-180], y=[-90], dw=[360], dh=[180]))
+        events = bkm.ColumnDataSource(data=dict(longitude=[], latitude=[], depth=[], mag=[], Date=[], place=[], size=[]))
+        mapper = bkm.LogColorMapper(palette=palette, low=1, high=10, nan_color=(0, 0, 0, 0))
+        map_plot = figure(plot_width=plot_width, plot_height=plot_height, x_range=(-180, 180), y_range=(-90, 90),
+                          title="Earthquakes", x_axis_label="Longitude", y_axis_label="Latitude",
+                          tools='pan,wheel_zoom,box_zoom,reset,save,crosshair')
+        map_plot.image(image='image', x='x', y='y', dw='dw', dh='dh', source=density, color_mapper=mapper)
+        event_renderer = map_plot.circle('longitude', 'latitude', size='size', source=events,
+                                         fill_color='firebrick', fill_alpha=0.4, line_alpha=0.6)
+        map_plot.add_tools(bkm.HoverTool(renderers=[event_renderer],
+                                         tooltips=[("place", "@place"), ("Date", "@Date"), ("depth", "@depth"),
+                                                   ("mag", "@mag")]))
+        map_plot.add_layout(bkm.ColorBar(color_mapper=mapper, location=(0, 0), width=15, title="events/pixel"), 'right')
+
+        # Gutenberg-Richter plot, as in output/a1_GutenbergRichter.html
+        gr_points = bkm.ColumnDataSource(data=dict(M=[], N=[]))
+        gr_fit = bkm.ColumnDataSource(data=dict(M=[], N_GR=[]))
+        gr_plot = figure(plot_width=plot_width//2, plot_height=plot_height, y_axis_type='log',
+                         title="Gutenberg-Richter relationship", x_axis_label="M (magnitude)",
+                         y_axis_label="N (number of earthquakes greater than M)")
+        gr_plot.line('M', 'N_GR', source=gr_fit, line_color='firebrick', line_width=3, legend_label="N = 10^(a - bM)")
+        gr_plot.circle('M', 'N', source=gr_points, size=10, fill_color='steelblue', fill_alpha=0.3, line_alpha=0.3)
+        gr_plot.add_tools(bkm.HoverTool(tooltips=[("Magnitude", "@M"), ("Earthquakes", "@N")]))
+
+        # Magnitude-depth histogram with the median depth per magnitude
+        md_image = bkm.ColumnDataSource(data=dict(image=[np.full((1, 1), np.nan)], x=[0], y=[0], dw=[1], dh=[1]))
+        md_median = bkm.ColumnDataSource(data=dict(mag=[], depth=[]))
+        md_mapper = bkm.LogColorMapper(palette=palette, low=1, high=10, nan_color=(0, 0, 0, 0))
+        md_plot = figure(plot_width=plot_width//2, plot_height=plot_height, title="Earthquake magnitude vs. depth",
+                         x_axis_label="Magnitude", y_axis_label="Depth (km)",
+                         y_range=bkm.Range1d(start=depth_slider.end, end=depth_slider.start))
+        md_plot.image(image='image', x='x', y='y', dw='dw', dh='dh', source=md_image, color_mapper=md_mapper)
+        md_plot.line('mag', 'depth', source=md_median, line_color='black', line_width=2, legend_label="median depth")
+
+        pending = []
+
+        def update():
+            del pending[:]
+            x_range = (max(map_plot.x_range.start, -180.), min(map_plot.x_range.end, 180.))
+            y_range = (max(map_plot.y_range.start, -90.), min(map_plot.y_range.end, 90.))
+            idx = store.select(lon=x_range, lat=y_range, mag=mag_slider.value, depth=depth_slider.value,
+                               time=time_slider.value_as_datetime)
+            cols = store.get(idx, ('longitude', 'latitude', 'depth', 'mag'))
+
+            counts = aggregate_points(cols['longitude'], cols['latitude'], x_range, y_range, plot_width, plot_height)
+            density.data = dict(image=[np.where(counts > 0, counts, np.nan)], x=[x_range[0]], y=[y_range[0]],
+                                dw=[x_range[1]-x_range[0]], dh=[y_range[1]-y_range[0]])
+            mapper.high = max(counts.max(), 2)
+            if len(idx) <= max_points:
+                df = store.dataframe(idx, places=store.meta['place'])
+                events.data = dict(longitude=df.longitude.values, latitude=df.latitude.values, depth=df.depth.values,
+                                   mag=df.mag.values, Date=df.time.astype(str).values,
+                                   place=df.place.values if 'place' in df else [''] * len(df),
+                                   size=2.**(df.mag.values - 4.))
+            else:
+                events.data = dict(longitude=[], latitude=[], depth=[], mag=[], Date=[], place=[], size=[])
+
+            gr = gutenberg_richter(cols['mag'])
+            gr_points.data = dict(M=gr['M'], N=gr['N'])
+            fit = gr['M'][gr['M'] >= gr['mc']] if np.isfinite(gr['b']) else gr['M'][:0]
+            gr_fit.data = dict(M=fit, N_GR=10**(gr['a'] - gr['b']*fit))
+
+            if len(idx):
+                md = mag_depth(cols['mag'], cols['depth'])
+                edges_m, edges_d = md['mag_edges'], md['depth_edges']
+                md_image.data = dict(image=[np.where(md['counts'] > 0, md['counts'], np.nan)], x=[edges_m[0]],
+                                     y=[edges_d[0]], dw=[edges_m[-1]-edges_m[0]], dh=[edges_d[-1]-edges_d[0]])
+                md_mapper.high = max(md['counts'].max(), 2)
+                md_median.data = dict(mag=md['mag_centers'], depth=md['depth_median'])
+            stats.text = ("<b>%d</b> earthquakes in view; b = %.2f &plusmn; %.2f, a = %.2f above M<sub>c</sub> = %.1f"
+                          % (len(idx), gr['b'], gr['b_err'], gr['a'], gr['mc']))
+
+        def schedule(attr, old, new):
+            # one update per batch of range/slider changes (e.g. start and end of a zoom)
+            if not pending:
+                pending.append(doc.add_next_tick_callback(update))
+
+        for rng in (map_plot.x_range, map_plot.y_range):
+            rng.on_change('start', schedule)
+            rng.on_change('end', schedule)
+        for slider in (mag_slider, depth_slider, time_slider):
+            slider.on_change('value_throttled', schedule)
+
+        update()
+        doc.add_root(layout([[map_plot], [mag_slider, depth_slider, time_slider], [stats], [gr_plot, md_plot]],
+                            sizing_mode='scale_width'))
+        doc.title = "Earthquake catalogue"
+
+    return modify_doc
+
+
+def serve(store_dir, port=5006, show=False, **app_options):
+    """
+    Run catalog_app for the store in store_dir on a Bokeh server at http://localhost:port/.
+
+    """
+    from bokeh.application import Application
+    from bokeh.application.handlers import FunctionHandler
+    from bokeh.server.server import Server
+
+    store = CatalogStore(store_dir)
+    server = Server({'/': Application(FunctionHandler(catalog_app(store, **app_options)))}, port=port)
+    server.start()
+    if show:
+        server.io_loop.add_callback(server.show, '/')
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local earthquake catalogue store and explorer app.')
+    commands = parser.add_subparsers(dest='command')
+    fetch = commands.add_parser('fetch', help='download the USGS catalogue and build a store')
+    fetch.add_argument('starttime')
+    fetch.add_argument('endtime')
+    fetch.add_argument('store_dir')
+    fetch.add_argument('--minmagnitude', type=float, default=5.)
+    fetch.add_argument('--step_days', type=int, default=365)
+    fetch.add_argument('--cache_dir', default=None, help='keep the downloaded csv chunks here')
+    fetch.add_argument('--cell_deg', type=float, default=1.)
+    build = commands.add_parser('build', help='build a store from a ComCat csv file')
+    build.add_argument('csv')
+    build.add_argument('store_dir')
+    build.add_argument('--cell_deg', type=float, default=1.)
+    serve_cmd = commands.add_parser('serve', help='explore a store in the browser')
+    serve_cmd.add_argument('store_dir')
+    serve_cmd.add_argument('--port', type=int, default=5006)
+    serve_cmd.add_argument('--show', action='store_true', help='open a browser tab')
+    args = parser.parse_args()
+
+    if args.command == 'fetch':
+        df = fetch_usgs(args.starttime, args.endtime, minmagnitude=args.minmagnitude, step_days=args.step_days,
+                        cache_dir=args.cache_dir)
+        print('%d events' % len(build_store(df, args.store_dir, cell_deg=args.cell_deg)))
+    elif args.command == 'build':
+        print('%d events' % len(build_store(read_catalog_csv(args.csv), args.store_dir, cell_deg=args.cell_deg)))
+    elif args.command == 'serve':
+        serve(args.store_dir, port=args.port, show=args.show)
+    else:
+        parser.print_help()
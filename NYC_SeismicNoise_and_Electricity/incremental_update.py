@@ -0,0 +1,210 @@
+# encoding: utf-8
+# Incremental updates of the NYC time series for EI LIVE 2020:
+# Instead of rebuilding Data/LD.CPNY...BHZ.csv and Data/load_reduction_hourly_NYC.csv from scratch, find
+# the last timestamp already stored, process only the hours (noise) or months (NYISO load) after it, and
+# append the new rows. The 2016-2019 median load used as the baseline is computed once and kept in
+# Data/load_baseline_NYC.csv, and the monthly NYISO zip files are cached in Data/nyiso.
+#
+#     import incremental_update
+#     incremental_update.update_load_reduction()  # NYISO load, from the cached (or downloaded) zip files
+#     incremental_update.update_noise(Client("IRIS"), 'Data/LD.CPNY.2020-02-09.2020-05-15.5_15Hz.BHZ.csv',
+#                                     'LD', 'CPNY', 'BHZ', fmin=5, fmax=15, tend='2020-06-01')
+#
+import os
+
+
+def nyiso_zip(monstr, zip_dir='Data/nyiso', download=True):
+    """
+    Path of the cached NYISO real-time load zip for the month monstr (YYYYMM01),
+    downloaded first if needed and download is True.
+
+    """
+    path = os.path.join(zip_dir, monstr+'pal_csv.zip')
+    if not os.path.isfile(path):
+        if not download:
+            raise IOError("%s is not cached" % path)
+        import requests
+        if not os.path.isdir(zip_dir):
+            os.makedirs(zip_dir)
+        query_url = "http://mis.nyiso.com/public/csv/pal/"+monstr+"pal_csv.zip"
+        response = requests.get(query_url)
+        response.raise_for_status()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(response.content)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def read_nyc_load(zip_path):
+    """
+    N.Y.C. load (columns Date, Load_megawatthours) from one monthly NYISO zip file,
+    as in 3_calc_NYCusage_anomaly.ipynb.
+
+    """
+    from zipfile import ZipFile
+    import pandas as pd
+
+    with ZipFile(zip_path, 'r') as zip:
+        # Load files into dictionary of dataframes
+        dfs = {text_file.filename: pd.read_csv(zip.open(text_file.filename))
+               for text_file in zip.infolist()
+               if text_file.filename.endswith('.csv')}
+    dfi = pd.concat(dfs.values(), ignore_index=True)
+    df = dfi[dfi.loc[:, 'Name'] == 'N.Y.C.']
+    df = df.rename(columns={'Time Stamp': 'Date', 'Load': 'Load_megawatthours'})[['Date', 'Load_megawatthours']]
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+def _months(start, end):
+    import pandas as pd
+
+    return pd.date_range(pd.Timestamp(start).replace(day=1), end, freq='MS').strftime("%Y%m01").tolist()
+
+
+def load_baseline(baseline_path='Data/load_baseline_NYC.csv', zip_dir='Data/nyiso', years=(2016, 2017, 2018, 2019),
+                  download=True):
+    """
+    Median over years of the hourly N.Y.C. load for every (month, day, hour), read from baseline_path
+    or computed once from the monthly zip files and saved there.
+
+    """
+    import pandas as pd
+
+    if os.path.isfile(baseline_path):
+        return pd.read_csv(baseline_path, index_col=['month', 'day', 'hour']).load_avg
+    df = pd.concat([read_nyc_load(nyiso_zip(monstr, zip_dir, download=download))
+                    for monstr in _months('%d-01-01' % min(years), '%d-12-01' % max(years))])
+    df = df.set_index('Date')
+    # Pivot table so we can calculate hourly averages by year
+    pv = pd.pivot_table(df, index=[df.index.month, df.index.day, df.index.hour], columns=[df.index.year],
+                        values='Load_megawatthours')
+    load_avg = pv.median(axis=1)
+    load_avg.index.names = ['month', 'day', 'hour']
+    load_avg.to_frame('load_avg').to_csv(baseline_path)
+    return load_avg
+
+
+def _stored_rows(csv_path, column, **read_csv_options):
+    """
+    Rows of csv_path up to the last one with a value in column, and the byte offset just after it.
+    Rows after it (placeholders without a value yet) are the ones an update replaces.
+
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_path, **read_csv_options)
+    filled = df[column].notnull().values.nonzero()[0]
+    if len(filled) == 0:
+        raise ValueError("%s has no %s values to continue from" % (csv_path, column))
+    last = filled[-1]
+    offset = 0
+    with open(csv_path, 'rb') as f:
+        for iline, line in enumerate(f):
+            offset += len(line)
+            if iline == last+1:  # line 0 is the header
+                break
+    return df.iloc[:last+1], offset
+
+
+def _append_rows(csv_path, offset, rows, key):
+    """
+    Replace the placeholder rows after offset in csv_path up to the last time in rows[key] by rows
+    (in the file's column order). Placeholders after that time are kept, unchanged, after them.
+
+    """
+    import io
+    import pandas as pd
+
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        f.seek(offset)
+        tail = [line for line in f.read().splitlines(True) if line.strip()]
+    if len(rows) and tail:
+        times = pd.read_csv(io.BytesIO(header + b''.join(tail)), usecols=[key], parse_dates=[key])[key]
+        tail = [line for line, t in zip(tail, times) if t > rows[key].iloc[-1]]
+    with open(csv_path, 'rb+') as f:
+        f.truncate(offset)
+        f.seek(offset-1)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+    rows[columns].to_csv(csv_path, mode='a', header=False, index=False)
+    with open(csv_path, 'ab') as f:
+        f.writelines(tail)
+    return rows[columns]
+
+
+def update_load_reduction(csv_path='Data/load_reduction_hourly_NYC.csv', zip_dir='Data/nyiso',
+                          baseline_path='Data/load_baseline_NYC.csv', end=None, download=True):
+    """
+    Append the hourly change in N.Y.C. electricity use (load_resid, % from the baseline median)
+    for every complete hour after the last one stored in csv_path, reading only the months since then.
+    Trailing rows that only hold the baseline are replaced up to the last new hour (later ones are
+    kept); earlier rows are never rewritten.
+    Returns the appended rows.
+
+    """
+    import pandas as pd
+
+    stored, offset = _stored_rows(csv_path, 'load_resid', parse_dates=['Date'])
+    last_date = stored.Date.iloc[-1]
+    end = pd.Timestamp.now() if end is None else pd.Timestamp(end)
+    load_avg = load_baseline(baseline_path, zip_dir, download=download)
+
+    df = pd.concat([read_nyc_load(nyiso_zip(monstr, zip_dir, download=download))
+                    for monstr in _months(last_date, end)])
+    # Hourly averages, keeping only complete hours after the last one stored
+    hourly = df.groupby(df.Date.dt.floor('h')).Load_megawatthours.mean()
+    if df.Date.max() < df.Date.max().floor('h') + pd.Timedelta(minutes=55):
+        hourly = hourly.iloc[:-1]
+    hourly = hourly[(hourly.index > last_date) & (hourly.index < end)]
+
+    new = pd.DataFrame({'Date': hourly.index})
+    new['load_avg'] = load_avg.reindex(list(zip(hourly.index.month, hourly.index.day, hourly.index.hour))).values
+    new['load_resid'] = (hourly.values-new.load_avg.values)/new.load_avg.values*100
+    return _append_rows(csv_path, offset, new, 'Date')
+
+
+def update_noise(client, csv_path, network, station, comp, fmin=5, fmax=15, winlen_hr=1, tend=None,
+                 cache_dir='Data/cache', block_days=1, processes=None, verbose=True):
+    """
+    Append hourly noise (disp_avg) and its daily average for the windows after the last one stored
+    in csv_path up to tend, computing only those windows with noise_pipeline. The daily average of
+    the new rows is seeded from the last day already stored, and trailing rows without a value
+    are replaced. Returns the appended rows.
+
+    """
+    import numpy as np
+    import pandas as pd
+    import noise_pipeline
+
+    stored, offset = _stored_rows(csv_path, 'disp_avg', parse_dates=['t_cent'])
+    winlen = pd.Timedelta(hours=winlen_hr)
+    tstart = stored.t_cent.iloc[-1] + winlen/2
+    tend = pd.Timestamp.now(tz='UTC').floor('h') if tend is None else pd.Timestamp(tend)
+    if tend.tzinfo is None:
+        tend = tend.tz_localize('UTC')
+    if tstart + winlen > tend:
+        return stored.iloc[:0]
+    t_cent = noise_pipeline.window_centers(tstart, tend, winlen_hr)
+
+    checkpoint = csv_path + '.update.checkpoint'
+    if block_days is None:
+        rms = noise_pipeline.compute_noise(client, network, station, comp, t_cent, winlen_hr, fmin, fmax, cache_dir,
+                                           checkpoint=checkpoint, processes=processes, verbose=verbose)
+    else:
+        rms = noise_pipeline.compute_noise_blocks(client, network, station, comp, t_cent, winlen_hr, fmin, fmax,
+                                                  cache_dir, block_days=block_days, checkpoint=checkpoint,
+                                                  processes=processes, verbose=verbose)
+    new = pd.DataFrame({'t_cent': t_cent, 'disp_avg': [rms.get(t, np.nan) for t in t_cent]})
+
+    # Daily average using boxcar window, continuing from the stored series
+    nwin = int(24/winlen_hr)
+    disp_avg = pd.concat([stored.disp_avg.iloc[-(nwin-1):], new.disp_avg], ignore_index=True)
+    new['daily_average'] = noise_pipeline.daily_average(disp_avg, nwin).values[-len(new):]
+
+    new = _append_rows(csv_path, offset, new, 't_cent')
+    if os.path.isfile(checkpoint):
+        os.remove(checkpoint)
+    return new
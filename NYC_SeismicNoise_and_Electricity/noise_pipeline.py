@@ -0,0 +1,425 @@
+# encoding: utf-8
+# Hourly seismic noise pipeline for EI LIVE 2020 (the download loop of 1_calc_daily_noise.ipynb as a module):
+#   1. download each window with a few threads into a local miniSEED cache (already cached windows are skipped)
+#   2. download the instrument response once for the whole time range (StationXML, also cached)
+#   3. remove the response, detrend, taper, bandpass and take the RMS of each window on a pool of processes
+#   4. append every finished window to a checkpoint csv, so an interrupted run picks up where it left off
+#
+# With block_days set, whole days (or several days) are downloaded and processed at once instead, and the
+# RMS of every window in the block is computed in one vectorised pass: one request and one response removal
+# per block rather than per window, and the edge tapers fall in padding outside the windows.
+#
+# The FDSN client is only used for downloading: with client=None everything is read from the cache,
+# and any object with get_waveforms/get_stations (like obspy's Client) can stand in for IRIS.
+#
+#     from obspy.clients.fdsn import Client
+#     import noise_pipeline
+#     df = noise_pipeline.run(Client("IRIS"), "LD", "CPNY", "BHZ", "2020-02-09T00:00:00", "2020-05-15T00:00:00",
+#                             fmin=5, fmax=15, winlen_hr=1, cache_dir='Data/cache', block_days=1)
+#
+import os
+import time
+
+
+def window_centers(tstart, tend, winlen_hr=1, overlap=0.):
+    """
+    Centers of windows of winlen_hr hours between tstart and tend (UTC), as in
+    1_calc_daily_noise.ipynb. overlap is the fraction of a window shared with the next one.
+
+    """
+    import pandas as pd
+
+    winlen_s = winlen_hr*60*60
+    step_s = winlen_s*(1-overlap)
+    starttime = pd.Timestamp(tstart) + pd.Timedelta(seconds=winlen_s/2)
+    endtime = pd.Timestamp(tend) - pd.Timedelta(seconds=winlen_s/2)
+    return pd.date_range(start=starttime, end=endtime,
+                         periods=round((endtime-starttime).total_seconds()/step_s)+1, tz='UTC')
+
+
+def noise_filename(network, station, comp, tstart, tend, fmin, fmax, datadir='Data/'):
+    """
+    Output csv name used by the notebooks, e.g. Data/LD.CPNY.2020-02-09.2020-05-15.5_15Hz.BHZ.csv
+
+    """
+    return (datadir+network+'.'+station+'.'+str(tstart)[0:10]+'.'+str(tend)[0:10]+'.'+
+            str(fmin)+'_'+str(fmax)+'Hz'+'.'+comp+'.csv')
+
+
+def cache_path(cache_dir, network, station, comp, t0, t1):
+    """
+    miniSEED cache file for one station/component between UTC times t0 and t1.
+
+    """
+    from obspy import UTCDateTime
+
+    fmt = '%Y%m%dT%H%M%S'
+    return os.path.join(cache_dir, '%s.%s.%s.%s.%s.mseed' % (network, station, comp,
+                                                            UTCDateTime(t0).strftime(fmt), UTCDateTime(t1).strftime(fmt)))
+
+
+def get_inventory(client, network, station, comp, tstart, tend, cache_dir):
+    """
+    Path of a StationXML file with the instrument response for the whole time range,
+    downloaded once and reused for every window (instead of attach_response on each request).
+
+    """
+    from obspy import UTCDateTime
+
+    path = os.path.join(cache_dir, '%s.%s.%s.%s.%s.xml' % (network, station, comp,
+                                                          UTCDateTime(tstart).strftime('%Y%m%d'),
+                                                          UTCDateTime(tend).strftime('%Y%m%d')))
+    if not os.path.isfile(path):
+        if client is None:
+            raise IOError("No cached response at %s and no client to download it" % path)
+        inventory = client.get_stations(network=network, station=station, channel=comp, level='response',
+                                        starttime=UTCDateTime(tstart), endtime=UTCDateTime(tend))
+        inventory.write(path + '.tmp', format='STATIONXML')
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def fetch_window(client, network, station, comp, t0, t1, cache_dir, retries=2, wait=5):
+    """
+    Path of the cached miniSEED file for t0 to t1, downloading it first if needed.
+    Failed requests are retried (waiting wait seconds in between) before the error is raised.
+
+    """
+    from obspy import UTCDateTime
+
+    path = cache_path(cache_dir, network, station, comp, t0, t1)
+    if os.path.isfile(path):
+        return path
+    if client is None:
+        raise IOError("%s is not cached and there is no client to download it" % path)
+    for attempt in range(retries+1):
+        try:
+            st = client.get_waveforms(network=network, station=station, location="*", channel=comp,
+                                      starttime=UTCDateTime(t0), endtime=UTCDateTime(t1))
+            break
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(wait)
+    st.write(path + '.tmp', format='MSEED')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+_inventories = {}  # StationXML files already read by this process
+
+
+def _read_inventory(inventory_path):
+    from obspy import read_inventory
+
+    if inventory_path not in _inventories:
+        _inventories[inventory_path] = read_inventory(inventory_path)
+    return _inventories[inventory_path]
+
+
+def data_gaps(st, max_gap_s=1.):
+    """
+    Gaps longer than max_gap_s seconds in st, before it is merged, as an array of
+    (last sample before, first sample after) UTC timestamps in seconds.
+
+    """
+    import numpy as np
+
+    gaps = [(g[4].timestamp, g[5].timestamp) for g in st.get_gaps() if g[5] - g[4] > max_gap_s]
+    return np.array(gaps, dtype=np.float64).reshape(-1, 2)
+
+
+def process_stream(st, inventory, fmin, fmax, taper_s=None):
+    """
+    Remove the instrument response (to displacement), detrend, taper and bandpass st in place,
+    with the same settings as 1_calc_daily_noise.ipynb. taper_s caps the length of the tapers
+    (in seconds) at either end, which otherwise cover 5% of the stream. Gaps are filled by
+    linear interpolation, so look for them with data_gaps first.
+
+    """
+    sr = st[0].stats.sampling_rate
+    st.merge(method=1, fill_value='interpolate')
+    duration = st[0].stats.endtime - st[0].stats.starttime
+    taper_fraction = 0.05 if taper_s is None else min(0.05, 2*taper_s/duration)
+    st.remove_response(inventory=inventory, output="DISP", zero_mean=True, taper=True, taper_fraction=taper_fraction,
+                       pre_filt=[0.001, 0.005, sr/3, sr/2], water_level=60)
+    st.detrend(type='demean')
+    st.detrend(type='linear')
+    st.taper(type="cosine", max_percentage=0.05, max_length=taper_s)
+    st.filter('bandpass', freqmin=fmin, freqmax=fmax, corners=2, zerophase=True)
+    return st
+
+
+def window_rms(mseed_path, inventory_path, fmin, fmax, max_gap_s=1.):
+    """
+    RMS displacement of one cached window after process_stream. A window with a gap longer
+    than max_gap_s seconds raises a ValueError rather than measuring the interpolated gap.
+
+    """
+    import numpy as np
+    from obspy import read
+
+    st = read(mseed_path)
+    if len(data_gaps(st, max_gap_s)):
+        raise ValueError("%s has gaps longer than %g s" % (mseed_path, max_gap_s))
+    st = process_stream(st, _read_inventory(inventory_path), fmin, fmax)
+    return float(np.sqrt(np.mean(st[0].data**2)))
+
+
+def block_rms(mseed_path, inventory_path, fmin, fmax, win_starts, winlen_s, taper_s, max_gap_s=1.):
+    """
+    RMS displacement of every window in a cached block after process_stream, in one pass:
+    win_starts are the windows' start times (UTC timestamps in seconds), and the sum of squares
+    over each window comes from the difference of a running sum, so overlapping windows cost
+    nothing extra. Windows not fully covered by the data, or overlapping a gap longer than
+    max_gap_s seconds (filled in by the merge), are NaN, as they fail in window_rms.
+
+    """
+    import numpy as np
+    from obspy import read
+
+    st = read(mseed_path)
+    gaps = data_gaps(st, max_gap_s)
+    st = process_stream(st, _read_inventory(inventory_path), fmin, fmax, taper_s=taper_s)
+    tr = st[0]
+    sr = tr.stats.sampling_rate
+    n = int(round(winlen_s*sr))
+    i0 = np.round((np.asarray(win_starts) - tr.stats.starttime.timestamp)*sr).astype(np.int64)
+    ok = (i0 >= 0) & (i0 + n <= tr.stats.npts)
+    csum = np.concatenate([[0.], np.cumsum(tr.data.astype(np.float64)**2)])
+    rms = np.full(len(i0), np.nan)
+    rms[ok] = np.sqrt(np.maximum(csum[i0[ok]+n] - csum[i0[ok]], 0)/n)
+    win_starts = np.asarray(win_starts, dtype=np.float64)
+    for g0, g1 in gaps:
+        rms[(win_starts < g1) & (win_starts + winlen_s > g0)] = np.nan
+    return rms
+
+
+def read_checkpoint(checkpoint):
+    """
+    Windows already finished in a previous run: {t_cent: disp_avg}.
+
+    """
+    import pandas as pd
+
+    if checkpoint is None or not os.path.isfile(checkpoint):
+        return {}
+    df = pd.read_csv(checkpoint, parse_dates=['t_cent'])
+    return dict(zip(df.t_cent, df.disp_avg))
+
+
+def _append_checkpoint(checkpoint, t_cent, disp_avg):
+    new = not os.path.isfile(checkpoint)
+    with open(checkpoint, 'a') as f:
+        if new:
+            f.write('t_cent,disp_avg\n')
+        f.write('%s,%r\n' % (t_cent, disp_avg))
+
+
+def compute_noise(client, network, station, comp, t_cent, winlen_hr, fmin, fmax, cache_dir,
+                  checkpoint=None, max_downloads=4, processes=None, max_gap_s=1., verbose=True):
+    """
+    RMS displacement for every window in t_cent (see window_centers), as a dict {t_cent: disp_avg}.
+    Windows are downloaded on max_downloads threads and processed on processes worker processes
+    as soon as they arrive. Windows in checkpoint are skipped and newly finished ones appended to it.
+    Windows that fail to download or process, or have gaps longer than max_gap_s seconds, are
+    left out (and reported) rather than replaced with a neighbouring window.
+
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+    import pandas as pd
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    winlen = pd.Timedelta(hours=winlen_hr)
+    done = read_checkpoint(checkpoint)
+    todo = [t for t in t_cent if t not in done]
+    inventory_path = get_inventory(client, network, station, comp, t_cent[0]-winlen/2, t_cent[-1]+winlen/2, cache_dir)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_downloads) as downloads, ProcessPoolExecutor(max_workers=processes) as pool:
+        fetches = {downloads.submit(fetch_window, client, network, station, comp, t-winlen/2, t+winlen/2, cache_dir): t
+                   for t in todo}
+        jobs = {}
+        for fetch in as_completed(fetches):
+            t = fetches[fetch]
+            try:
+                jobs[pool.submit(window_rms, fetch.result(), inventory_path, fmin, fmax, max_gap_s)] = t
+            except Exception as err:
+                failed.append(t)
+                if verbose:
+                    print(str(t)+' download failed: '+repr(err))
+        for job in as_completed(jobs):
+            t = jobs[job]
+            try:
+                done[t] = job.result()
+            except Exception as err:
+                failed.append(t)
+                if verbose:
+                    print(str(t)+' processing failed: '+repr(err))
+                continue
+            if checkpoint is not None:
+                _append_checkpoint(checkpoint, t, done[t])
+    if verbose:
+        print('%d windows, %d computed, %d failed' % (len(t_cent), len(todo)-len(failed), len(failed)))
+    return done
+
+
+def compute_noise_blocks(client, network, station, comp, t_cent, winlen_hr, fmin, fmax, cache_dir,
+                         block_days=1, pad_s=3600, checkpoint=None, max_downloads=4, processes=None, max_gap_s=1.,
+                         verbose=True):
+    """
+    Same as compute_noise, but data are downloaded and processed in blocks of block_days days
+    (plus pad_s seconds either side, which take the tapers and filter edge effects), and all
+    windows starting in a block are computed from it at once (see block_rms).
+
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+    import numpy as np
+    import pandas as pd
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    winlen = pd.Timedelta(hours=winlen_hr)
+    winlen_s = winlen.total_seconds()
+    pad = pd.Timedelta(seconds=pad_s)
+    done = read_checkpoint(checkpoint)
+    todo = t_cent[~t_cent.isin(list(done))]
+    if len(todo) == 0:
+        if verbose:
+            print('%d windows, all done in %s' % (len(t_cent), checkpoint))
+        return done
+    inventory_path = get_inventory(client, network, station, comp, t_cent[0]-winlen/2-pad, t_cent[-1]+winlen/2+pad,
+                                   cache_dir)
+
+    # Group windows by the block (whole days from the first window) their start falls in
+    starts = todo - winlen/2
+    block_len = pd.Timedelta(days=block_days)
+    origin = (t_cent[0] - winlen/2).floor('D')
+    block_id = np.asarray((starts - origin)//block_len)
+    blocks = []
+    for b in np.unique(block_id):
+        win = np.flatnonzero(block_id == b)
+        b0 = origin + b*block_len
+        b1 = max(b0 + block_len, starts[win[-1]] + winlen)  # windows may run past the end of the block
+        blocks.append((b0-pad, b1+pad, todo[win]))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_downloads) as downloads, ProcessPoolExecutor(max_workers=processes) as pool:
+        fetches = {downloads.submit(fetch_window, client, network, station, comp, t0, t1, cache_dir): wins
+                   for t0, t1, wins in blocks}
+        jobs = {}
+        for fetch in as_completed(fetches):
+            wins = fetches[fetch]
+            win_starts = np.array([(t - winlen/2).timestamp() for t in wins])
+            try:
+                jobs[pool.submit(block_rms, fetch.result(), inventory_path, fmin, fmax, win_starts, winlen_s,
+                                 pad_s/2, max_gap_s)] = wins
+            except Exception as err:
+                failed.extend(wins)
+                if verbose:
+                    print(str(wins[0])+' to '+str(wins[-1])+' download failed: '+repr(err))
+        for job in as_completed(jobs):
+            wins = jobs[job]
+            try:
+                rms = job.result()
+            except Exception as err:
+                failed.extend(wins)
+                if verbose:
+                    print(str(wins[0])+' to '+str(wins[-1])+' processing failed: '+repr(err))
+                continue
+            for t, r in zip(wins, rms):
+                if np.isnan(r):
+                    failed.append(t)
+                    continue
+                done[t] = float(r)
+                if checkpoint is not None:
+                    _append_checkpoint(checkpoint, t, done[t])
+    if verbose:
+        print('%d windows in %d blocks, %d computed, %d failed' %
+              (len(t_cent), len(blocks), len(todo)-len(failed), len(failed)))
+    return done
+
+
+def daily_average(disp_avg, nwin):
+    """
+    Boxcar average of disp_avg (a pandas Series) over nwin windows, i.e. one day. Missing windows
+    are skipped as long as at least half of the day is there, so a single failed window does not
+    blank out a whole day of averages.
+
+    """
+    return disp_avg.rolling(nwin, win_type='boxcar', min_periods=max(nwin//2, 1)).mean()
+
+
+def noise_dataframe(t_cent, rms):
+    """
+    Hourly noise and its daily average in the layout of the notebooks' csv files
+    (failed windows are NaN).
+
+    """
+    import pandas as pd
+
+    df = pd.DataFrame({'t_cent': t_cent,
+                       'disp_avg': [rms.get(t, float('nan')) for t in t_cent]})
+    # Calculate daily averages using boxcar window
+    dt_hr = (df.t_cent[1]-df.t_cent[0]).seconds/60/60  # Hours between samples
+    df['daily_average'] = daily_average(df.disp_avg, int(24/dt_hr))
+    return df
+
+
+def run(client, network, station, comp, tstart, tend, fmin=5, fmax=15, winlen_hr=1, cache_dir='Data/cache',
+        datadir='Data/', max_downloads=4, processes=None, verbose=True, block_days=None, overlap=0.):
+    """
+    Compute hourly noise between tstart and tend and save it where the plotting notebooks expect it.
+    Progress is checkpointed next to the output csv, so running again after a crash resumes.
+    With block_days set, data are processed in blocks of that many days (see compute_noise_blocks),
+    and windows may overlap by the fraction overlap. Returns the dataframe.
+
+    """
+    filename = noise_filename(network, station, comp, tstart, tend, fmin, fmax, datadir=datadir)
+    t_cent = window_centers(tstart, tend, winlen_hr, overlap=overlap)
+    if block_days is None:
+        if overlap:
+            raise ValueError("Overlapping windows need block_days")
+        rms = compute_noise(client, network, station, comp, t_cent, winlen_hr, fmin, fmax, cache_dir,
+                            checkpoint=filename+'.checkpoint', max_downloads=max_downloads, processes=processes,
+                            verbose=verbose)
+    else:
+        rms = compute_noise_blocks(client, network, station, comp, t_cent, winlen_hr, fmin, fmax, cache_dir,
+                                   block_days=block_days, checkpoint=filename+'.checkpoint',
+                                   max_downloads=max_downloads, processes=processes, verbose=verbose)
+    df = noise_dataframe(t_cent, rms)
+    df.to_csv(filename, index=False)
+    return df
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Hourly seismic noise (RMS displacement) from FDSN data.')
+    parser.add_argument('--webservice', default='IRIS', help='FDSN data center (use "none" to read only the cache)')
+    parser.add_argument('--network', default='LD')
+    parser.add_argument('--station', default='CPNY')
+    parser.add_argument('--comp', default='BHZ')
+    parser.add_argument('--tstart', default='2020-02-09T00:00:00')
+    parser.add_argument('--tend', default='2020-05-15T00:00:00')
+    parser.add_argument('--fmin', type=float, default=5)
+    parser.add_argument('--fmax', type=float, default=15)
+    parser.add_argument('--winlen_hr', type=float, default=1)
+    parser.add_argument('--cache_dir', default='Data/cache')
+    parser.add_argument('--max_downloads', type=int, default=4)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--block_days', type=float, default=None, help='process data in blocks of this many days')
+    parser.add_argument('--overlap', type=float, default=0., help='fraction of overlap between windows')
+    args = parser.parse_args()
+
+    if args.webservice.lower() == 'none':
+        client = None
+    else:
+        from obspy.clients.fdsn import Client
+        client = Client(args.webservice)
+    fmin = int(args.fmin) if args.fmin == int(args.fmin) else args.fmin
+    fmax = int(args.fmax) if args.fmax == int(args.fmax) else args.fmax
+    run(client, args.network, args.station, args.comp, args.tstart, args.tend, fmin=fmin, fmax=fmax,
+        winlen_hr=args.winlen_hr, cache_dir=args.cache_dir, max_downloads=args.max_downloads,
+        processes=args.processes, block_days=args.block_days, overlap=args.overlap)
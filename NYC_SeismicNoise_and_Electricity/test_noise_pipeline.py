@@ -0,0 +1,133 @@
+# encoding: utf-8
+# Offline tests of noise_pipeline.py and incremental_update.py: a fake FDSN client serves synthetic
+# data for the example station that ships with obspy (GR.FUR BHZ, obspy.read_inventory()), so no
+# data center is needed. Run from this folder with
+#
+#     python -m pytest test_noise_pipeline.py
+#
+import numpy as np
+import pandas as pd
+import pytest
+
+obspy = pytest.importorskip('obspy')
+from obspy import Stream, Trace, UTCDateTime
+
+import incremental_update
+import noise_pipeline
+
+NET, STA, COMP = 'GR', 'FUR', 'BHZ'
+FS = 20.
+OPTS = dict(fmin=2, fmax=8, processes=2, verbose=False)
+
+
+class FakeClient(object):
+    """
+    Stands in for obspy's FDSN Client: the same samples for the same times whatever the request,
+    a 7 Hz tone whose amplitude varies over the day. Requests overlapping a time in fail raise an
+    IOError, and the data between gap[0] and gap[1] are missing.
+
+    """
+    def __init__(self, fail=(), gap=None):
+        self.fail = [UTCDateTime(t) for t in fail]
+        self.gap = None if gap is None else [UTCDateTime(t) for t in gap]
+        self.calls = 0
+
+    def get_stations(self, network, station, channel, **options):
+        return obspy.read_inventory().select(network=network, station=station, channel=channel)
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime):
+        self.calls += 1
+        if any(starttime <= t < endtime for t in self.fail):
+            raise IOError('no data')
+        i = np.arange(int(round(starttime.timestamp*FS)), int(round(endtime.timestamp*FS)) + 1)
+        data = 1000*np.sin(2*np.pi*7*i/FS)*(1 + 0.5*np.sin(2*np.pi*i/FS/86400.)) + 50*np.cos(0.37*i)
+        tr = Trace(data=data, header=dict(network=network, station=station, channel=channel,
+                                          sampling_rate=FS, starttime=UTCDateTime(i[0]/FS)))
+        if self.gap is not None and starttime < self.gap[1] and endtime > self.gap[0]:
+            parts = [tr.slice(tr.stats.starttime, self.gap[0]), tr.slice(self.gap[1], tr.stats.endtime)]
+            return Stream([part for part in parts if part.stats.npts > 1])
+        return Stream([tr])
+
+
+def test_data_gaps():
+    st = FakeClient(gap=('2010-03-01T01:00:00', '2010-03-01T01:00:05')).get_waveforms(
+        NET, STA, '', COMP, UTCDateTime('2010-03-01T00:00:00'), UTCDateTime('2010-03-01T02:00:00'))
+    gaps = noise_pipeline.data_gaps(st)
+    assert len(gaps) == 1
+    np.testing.assert_allclose(gaps[0], [UTCDateTime('2010-03-01T01:00:00').timestamp,
+                                         UTCDateTime('2010-03-01T01:00:05').timestamp], atol=1/FS)
+    assert len(noise_pipeline.data_gaps(st, max_gap_s=10.)) == 0
+
+
+def test_block_rms_matches_window_rms(tmp_path):
+    # 3 hours without data: those windows fail in window_rms and are NaN in block_rms
+    gap = ('2010-03-01T03:00:00', '2010-03-01T06:00:00')
+    tstart, tend = '2010-03-01T00:00:00', '2010-03-02T00:00:00'
+    per_window = noise_pipeline.run(FakeClient(gap=gap), NET, STA, COMP, tstart, tend, cache_dir=str(tmp_path/'a'),
+                                    datadir=str(tmp_path/'a_'), **OPTS)
+    blocks = noise_pipeline.run(FakeClient(gap=gap), NET, STA, COMP, tstart, tend, cache_dir=str(tmp_path/'b'),
+                                datadir=str(tmp_path/'b_'), block_days=1, **OPTS)
+    assert list(per_window.t_cent[per_window.disp_avg.isnull()].dt.hour) == [3, 4, 5]
+    assert list(blocks.t_cent[blocks.disp_avg.isnull()].dt.hour) == [3, 4, 5]
+    # window_rms tapers the edges of every window, which lowers its RMS by a few percent
+    np.testing.assert_allclose(blocks.disp_avg, per_window.disp_avg, rtol=0.05)
+    # missing hours do not blank out the daily average: it starts once half a day (12 windows) is there
+    assert list(blocks.daily_average.notnull()) == [False]*14 + [True]*10
+
+
+def test_checkpoint_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(noise_pipeline.time, 'sleep', lambda seconds: None)  # no waiting between retries
+    tstart, tend = '2010-03-01T00:00:00', '2010-03-03T00:00:00'
+    options = dict(OPTS, cache_dir=str(tmp_path/'cache'), datadir=str(tmp_path/'x_'), block_days=1)
+    ref = noise_pipeline.run(FakeClient(), NET, STA, COMP, tstart, tend, cache_dir=str(tmp_path/'ref'),
+                             datadir=str(tmp_path/'ref_'), block_days=1, **OPTS)
+
+    # the second day fails to download, the first is checkpointed
+    first = noise_pipeline.run(FakeClient(fail=['2010-03-02T12:00:00']), NET, STA, COMP, tstart, tend, **options)
+    assert first.disp_avg.notnull().sum() == 24
+    checkpoint = noise_pipeline.noise_filename(NET, STA, COMP, tstart, tend, 2, 8, str(tmp_path/'x_')) + '.checkpoint'
+    assert len(noise_pipeline.read_checkpoint(checkpoint)) == 24
+
+    # resuming downloads only the missing day
+    client = FakeClient()
+    second = noise_pipeline.run(client, NET, STA, COMP, tstart, tend, **options)
+    assert client.calls == 1
+    np.testing.assert_allclose(second.disp_avg, ref.disp_avg, rtol=1e-9)
+
+    # and a finished run downloads nothing
+    client = FakeClient()
+    noise_pipeline.run(client, NET, STA, COMP, tstart, tend, **options)
+    assert client.calls == 0
+
+
+def test_update_noise_appends(tmp_path):
+    ref = noise_pipeline.run(FakeClient(), NET, STA, COMP, '2010-03-01T00:00:00', '2010-03-04T00:00:00',
+                             cache_dir=str(tmp_path/'ref'), datadir=str(tmp_path/'ref_'), block_days=1, **OPTS)
+
+    # two days stored in the notebooks' column order, followed by placeholder rows for two more days
+    stored = noise_pipeline.run(FakeClient(), NET, STA, COMP, '2010-03-01T00:00:00', '2010-03-03T00:00:00',
+                                cache_dir=str(tmp_path/'cache'), datadir=str(tmp_path/'x_'), block_days=1, **OPTS)
+    placeholders = pd.DataFrame({'t_cent': noise_pipeline.window_centers('2010-03-03T00:00:00', '2010-03-05T00:00:00'),
+                                 'disp_avg': np.nan, 'daily_average': np.nan})
+    csv_path = str(tmp_path/'noise.csv')
+    columns = ['disp_avg', 't_cent', 'daily_average']
+    pd.concat([stored, placeholders], ignore_index=True)[columns].to_csv(csv_path, index=False)
+
+    new = incremental_update.update_noise(FakeClient(), csv_path, NET, STA, COMP, fmin=2, fmax=8,
+                                          tend='2010-03-04T00:00:00', cache_dir=str(tmp_path/'cache'),
+                                          processes=2, verbose=False)
+    assert len(new) == 24 and list(new.columns) == columns
+    df = pd.read_csv(csv_path, parse_dates=['t_cent'])
+    assert list(df.columns) == columns
+    assert len(df) == 4*24
+    # the third day matches a full run, the placeholders for the fourth day are kept as they were
+    np.testing.assert_allclose(df.disp_avg[:72], ref.disp_avg, rtol=1e-9)
+    np.testing.assert_allclose(df.daily_average[:72], ref.daily_average, rtol=1e-9)
+    assert df.disp_avg[72:].isnull().all()
+    assert (df.t_cent[72:].values == placeholders.t_cent[24:].values).all()
+
+    # nothing left to do
+    assert len(incremental_update.update_noise(FakeClient(), csv_path, NET, STA, COMP, fmin=2, fmax=8,
+                                               tend='2010-03-04T00:00:00', cache_dir=str(tmp_path/'cache'),
+                                               processes=2, verbose=False)) == 0
+    assert len(pd.read_csv(csv_path)) == 4*24
@@ -8,6 +8,788 @@ import bokeh.models as bkm
 import bokeh.core as bkc
 
 
+# =================================
+# Streaming helpers: these let long records (days to months of continuous data) be sonified
+# without ever holding more than a few blocks of the resampled waveform in memory.
+
+def _global_peak(data, block_len=2**20):
+    """
+    Largest absolute value of data, read one block at a time.
+    Works on memory-mapped arrays without loading them into memory.
+
+    """
+    import numpy as np
+
+    peak = 0.
+    for i0 in range(0, len(data), block_len):
+        peak = max(peak, float(np.amax(np.abs(data[i0:i0+block_len]))))
+    return peak
+
+
+def _write_wav_stream(wav_file, fs, blocks):
+    """
+    Write blocks of normalized samples (-1 to 1) to wav_file (path or file object) as 16 bit PCM,
+    one block at a time. Returns the number of frames written.
+
+    """
+    import numpy as np
+    import wave
+
+    nframes = 0
+    with wave.open(wav_file, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(int(fs))
+        for block in blocks:
+            w.writeframes(np.clip(np.round(block*32767), -32768, 32767).astype('<i2').tobytes())
+            nframes += len(block)
+    return nframes
+
+
+def _wav_data_uri(wav_path, chunk_len=3*2**20):
+    """
+    Base64-encoded data URI for a wav file, encoded in chunks rather than from a full copy in memory.
+    chunk_len must be a multiple of 3 so the chunks can be joined without padding.
+
+    """
+    import base64
+
+    parts = ['data:audio/wav;base64,']
+    with open(wav_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_len), b''):
+            parts.append(base64.b64encode(chunk).decode('UTF-8'))
+    return ''.join(parts)
+
+
+def _audio_blocks(data, resampler, stream=False, block_len=2**20):
+    """
+    Audio resampled with resampler (a resampling.Resampler) as blocks of normalized samples:
+    block by block and normalized by the global peak of data if stream, otherwise one block
+    resampled in one go and normalized by its own peak.
+
+    """
+    import numpy as np
+
+    if stream:
+        return resampler.blocks(data, block_len, scale=1./_global_peak(data, block_len))
+    datar = resampler.resample(data)
+    return [datar/np.amax(np.absolute(datar))]
+
+
+def _wav_source(blocks, fs_resamp, wav_path=None):
+    """
+    Write blocks to wav_path (a temporary file if None) and return the base64-encoded audio_source.
+
+    """
+    import os
+    import tempfile
+
+    if wav_path is not None:
+        _write_wav_stream(wav_path, fs_resamp, blocks)
+        return _wav_data_uri(wav_path)
+    fd, tmp_path = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    try:
+        _write_wav_stream(tmp_path, fs_resamp, blocks)
+        return _wav_data_uri(tmp_path)
+    finally:
+        os.remove(tmp_path)
+
+
+def _write_audio_stream(audio_file, fs, blocks):
+    """
+    Write blocks of normalized samples to audio_file, with the format picked from its extension:
+    .wav is written directly, .ogg (Vorbis) and .flac are encoded locally with soundfile.
+
+    """
+    import os
+
+    ext = os.path.splitext(audio_file)[1].lower()
+    if ext == '.wav':
+        return _write_wav_stream(audio_file, fs, blocks)
+    if ext not in ('.ogg', '.flac'):
+        raise ValueError("audio_file must end in .wav, .ogg or .flac, got '%s'" % audio_file)
+    try:
+        import soundfile
+    except ImportError:
+        raise ImportError("Writing %s audio requires the soundfile package (pip install soundfile)" % ext)
+
+    nframes = 0
+    subtype = 'VORBIS' if ext == '.ogg' else 'PCM_16'
+    with soundfile.SoundFile(audio_file, 'w', samplerate=int(fs), channels=1,
+                             format=ext[1:].upper(), subtype=subtype) as f:
+        for block in blocks:
+            f.write(block.clip(-1, 1))
+            nframes += len(block)
+    return nframes
+
+
+def _sidecar_source(blocks, fs_resamp, audio_file, audio_url=None):
+    """
+    Write blocks to audio_file next to the html page and return the URL the player should load
+    it from (audio_url, or audio_file itself as a relative URL).
+
+    """
+    import os
+
+    audio_dir = os.path.dirname(audio_file)
+    if audio_dir and not os.path.isdir(audio_dir):
+        os.makedirs(audio_dir)
+    _write_audio_stream(audio_file, fs_resamp, blocks)
+    return audio_url if audio_url is not None else audio_file.replace(os.sep, '/')
+
+
+def _sidecar_url(audio_file, audio_url, suffix):
+    """
+    URL prefix, as seen from the page, of the files written next to audio_file as
+    os.path.splitext(audio_file)[0] + suffix + '...': the directory of audio_url (or of audio_file
+    if None) followed by the file name, so a query string or dots in directory names do not matter.
+
+    """
+    import os
+    import posixpath
+    from urllib.parse import quote, urlsplit, urlunsplit
+
+    url = audio_url if audio_url is not None else audio_file.replace(os.sep, '/')
+    scheme, netloc, path = urlsplit(url)[:3]
+    name = quote(os.path.basename(os.path.splitext(audio_file)[0]) + suffix)
+    return urlunsplit((scheme, netloc, posixpath.join(posixpath.dirname(path), name), '', ''))
+
+
+def _sonify_audio(data, fs, TargetDuration, resampler, stream=False, block_len=2**20, wav_path=None,
+                  audio_file=None, audio_url=None, cache_dir=None, cache_max_bytes=2**30):
+    """
+    audio_source for the player when audio goes through a file: streamed, written next to the
+    page and/or read back from the cache.
+
+    """
+    fs_resamp = resampler.fs_out
+    if cache_dir is not None:
+        blocks = _cached_audio_blocks(data, fs, TargetDuration, resampler, stream=stream,
+                                      block_len=block_len, cache_dir=cache_dir, cache_max_bytes=cache_max_bytes)
+    else:
+        blocks = _audio_blocks(data, resampler, stream=stream, block_len=block_len)
+    if audio_file is not None:
+        return _sidecar_source(blocks, fs_resamp, audio_file, audio_url=audio_url)
+    return _wav_source(blocks, fs_resamp, wav_path=wav_path)
+
+
+# =================================
+# Cache helpers: resampled audio and spectrograms are stored on disk under a hash of the input
+# data and the parameters used, so re-rendering the same trace (e.g. with another palette)
+# skips the expensive steps. The least recently used entries are evicted past cache_max_bytes.
+
+def _cache_key(data, kind, block_len=2**20, **params):
+    """
+    Content hash of data (read one block at a time) together with kind and params.
+
+    """
+    import hashlib
+    import numpy as np
+
+    h = hashlib.sha1()
+    h.update(('%s %r %s %d' % (kind, sorted(params.items()), np.asarray(data[:0]).dtype.str, len(data))).encode('UTF-8'))
+    for i0 in range(0, len(data), block_len):
+        h.update(np.ascontiguousarray(data[i0:i0+block_len]).tobytes())
+    return h.hexdigest()
+
+
+def _cache_get(cache_dir, key, ext):
+    """
+    Path of the cache entry for key, or None if it is not cached. A hit marks the entry as recently used.
+
+    """
+    import os
+
+    path = os.path.join(cache_dir, key + ext)
+    if not os.path.isfile(path):
+        return None
+    os.utime(path, None)
+    return path
+
+
+def _cache_tmp(cache_dir, key, ext):
+    """
+    Path of a new temporary file in cache_dir to write the entry for key to before moving it in
+    place with os.replace. Its name is unique, so processes sharing cache_dir never write to the
+    same file.
+
+    """
+    import tempfile
+
+    with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=key + '.', suffix=ext + '.tmp', delete=False) as f:
+        return f.name
+
+
+def _cache_evict(cache_dir, max_bytes, keep=None):
+    """
+    Remove least recently used cache entries (other than keep) until the cache takes at most max_bytes.
+
+    """
+    import os
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(('.npy', '.npz')) and os.path.isfile(path) and path != keep:
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(e[1] for e in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def _cached_audio_blocks(data, fs, TargetDuration, resampler, stream=False, block_len=2**20,
+                         cache_dir='.sonify_cache', cache_max_bytes=2**30):
+    """
+    Like _audio_blocks, but the 16 bit PCM is kept in the cache. Cached PCM is memory-mapped and
+    read back one block at a time.
+
+    """
+    import os
+    import numpy as np
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    key = _cache_key(data, 'pcm', block_len=block_len, fs=fs, TargetDuration=TargetDuration,
+                     fs_sound=resampler.fs_in, fs_resamp=resampler.fs_out, resampler=resampler.method,
+                     quality=resampler.quality, stream=bool(stream))
+    path = _cache_get(cache_dir, key, '.npy')
+    if path is None:
+        path = os.path.join(cache_dir, key + '.npy')
+        n_out = resampler.backend.n_out(len(data))
+        tmp_path = _cache_tmp(cache_dir, key, '.npy')
+        try:
+            pcm = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int16, shape=(n_out,))
+            i0 = 0
+            for block in _audio_blocks(data, resampler, stream=stream, block_len=block_len):
+                pcm[i0:i0+len(block)] = np.clip(np.round(block*32767), -32768, 32767)
+                i0 += len(block)
+            pcm.flush()
+            del pcm
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        _cache_evict(cache_dir, cache_max_bytes, keep=path)
+    pcm = np.load(path, mmap_mode='r')
+    for i0 in range(0, len(pcm), block_len):
+        yield pcm[i0:i0+block_len]/32767.
+
+
+# =================================
+# Level-of-detail helpers: plot a min/max envelope of the waveform with a fixed number of
+# points for the current view, swapping in finer levels as the user zooms in.
+
+def _minmax_pyramid(y, min_points=4000, block_len=2**20, mem_points=2**20):
+    """
+    Min/max envelope pyramid of y, ordered from coarsest to finest level.
+    Each level is (bin_len, idx, val): the sample indices and values of the minimum and maximum of
+    every bin of bin_len samples, in the order they occur, so a line through them traces the same
+    envelope as the raw data. Bins double in width at every coarser level, and the coarsest level
+    has at most min_points points. The finest level is the raw data itself (bin_len=1, idx=None).
+    y is read one block at a time and every level is reduced from the block, so memory does not
+    grow with len(y): levels of more than mem_points points are memory-mapped temporary files.
+
+    """
+    import tempfile
+    import numpy as np
+
+    def envelope(vals, group):
+        # min and max of every group of values, in the order they occur within the group
+        nb = -(-len(vals)//group)
+        pad = nb*group - len(vals)
+        v = np.concatenate([vals, np.repeat(vals[-1:], pad)]).reshape(nb, group) if pad else vals.reshape(nb, group)
+        imin, imax = np.argmin(v, axis=1), np.argmax(v, axis=1)
+        first = np.stack([np.minimum(imin, imax), np.maximum(imin, imax)], axis=1)
+        first = np.minimum(first + (np.arange(nb)*group)[:, None], len(vals)-1)
+        return first.ravel()
+
+    n = len(y)
+    levels = [(1, None, y)]
+    if n <= min_points:
+        return levels
+
+    # Level sizes: bins of 4 samples first, then pairs of bins (4 points) merged at every level
+    bin_lens, sizes = [4], [2*(-(-n//4))]
+    while sizes[-1] > min_points:
+        bin_lens.append(2*bin_lens[-1])
+        sizes.append(2*(-(-sizes[-1]//4)))
+
+    def alloc(size, dtype):
+        if size <= mem_points:
+            return np.empty(size, dtype=dtype)
+        return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=(size,))
+    out = [(alloc(size, np.int64), alloc(size, np.float32)) for size in sizes]
+
+    # Blocks hold whole bins of every level, so reducing them one by one gives the same envelope
+    block_len = max(block_len//bin_lens[-1], 1)*bin_lens[-1]
+    pos = [0]*len(sizes)
+    for i0 in range(0, n, block_len):
+        block = np.asarray(y[i0:i0+block_len])
+        idx = envelope(block, 4)
+        val = block[idx].astype(np.float32)
+        idx = idx + i0
+        for k in range(len(sizes)):
+            if k > 0:
+                keep = envelope(val, 4)
+                idx, val = idx[keep], val[keep]
+            out[k][0][pos[k]:pos[k]+len(idx)] = idx
+            out[k][1][pos[k]:pos[k]+len(idx)] = val
+            pos[k] += len(idx)
+    levels += [(bin_len, idx, val) for bin_len, (idx, val) in zip(bin_lens, out)]
+    return levels[::-1]
+
+
+# Envelope points embedded in a page whose finer levels are fetched on zoom: about 4 per pixel
+# of an 800 pixel wide plot, the callback refines the view from there
+_LOD_EMBED_POINTS = 3200
+
+_LOD_CALLBACK = """
+// Pick the finest level that keeps the visible part of the trace under npoints points
+var x0 = Math.max(xr.start, 0), x1 = xr.end;
+var k = 0;
+for (var i = 0; i < levels.length; i++) {
+    if ((x1 - x0)*levels[i].pps <= npoints) { k = i; }
+}
+var cache = source.lod_cache || (source.lod_cache = {});
+// Slice out the visible points, plus one either side so the line reaches the plot edges
+function bisect(a, x) {
+    var lo = 0, hi = a.length;
+    while (lo < hi) { var mid = (lo + hi) >> 1; if (a[mid] < x) { lo = mid + 1; } else { hi = mid; } }
+    return lo;
+}
+function load(url, k) {
+    cache[url] = null;
+    fetch(url).then(function(r) {
+        if (!r.ok) { throw new Error(r.status + ' ' + r.statusText); }
+        return r.arrayBuffer();
+    }).then(function(buf) {
+        // chunk file: float64 times followed by float32 values
+        var m = buf.byteLength/12;
+        cache[url] = {t: new Float64Array(buf, 0, m), y: new Float32Array(buf, 8*m, m)};
+        xr.properties.start.change.emit();
+    }).catch(function(err) {
+        // forget the request so the next zoom or pan retries it, and show the next coarser level
+        // at hand meanwhile (the embedded coarsest level at least)
+        delete cache[url];
+        console.warn('Could not load ' + url + ': ' + err);
+        for (var j = k - 1; j >= 0 && !show(j, false); j--) {}
+    });
+}
+// Show level k, if it is embedded or all of its chunks covering the view have arrived; with
+// fetch set, request the missing chunks
+function show(k, fetch) {
+    var lev = levels[k];
+    var t, y;
+    if (lev.src != null) {
+        t = lev.src.data.t;
+        y = lev.src.data.y;
+    } else {
+        // Level stored as separate chunk files: fetch only the chunks covering the view
+        var c0 = Math.max(Math.floor(x0/lev.chunk_dt), 0);
+        var c1 = Math.min(Math.floor(x1/lev.chunk_dt), lev.nchunks - 1);
+        var chunks = [], missing = false;
+        for (var c = c0; c <= c1; c++) {
+            var url = lev.url.replace('{}', c);
+            if (cache[url] === undefined && fetch) { load(url, k); }
+            if (cache[url] == null) { missing = true; } else { chunks.push(cache[url]); }
+        }
+        if (missing) { return false; }
+        var m = 0;
+        for (var j = 0; j < chunks.length; j++) { m += chunks[j].t.length; }
+        t = new Float64Array(m);
+        y = new Float32Array(m);
+        m = 0;
+        for (var j = 0; j < chunks.length; j++) {
+            t.set(chunks[j].t, m);
+            y.set(chunks[j].y, m);
+            m += chunks[j].t.length;
+        }
+    }
+    var i0 = Math.max(bisect(t, x0) - 1, 0), i1 = Math.min(bisect(t, x1) + 1, t.length);
+    source.data = {time_steps: t.slice(i0, i1), data: y.slice(i0, i1)};
+    return true;
+}
+// keep showing what is there until the chunks have arrived
+show(k, true);
+"""
+
+
+def _attach_lod(plot, source, y, fs_plot, lod_points=4000, lod_file=None, lod_url=None,
+                lod_chunk=2**16, lod_max_points=_LOD_EMBED_POINTS, scale=1.):
+    """
+    Plot y (sampled at fs_plot in plot x units) through a min/max envelope pyramid.
+    source starts out with the coarsest level and a callback on plot.x_range swaps in the finest
+    level with at most lod_points visible points. Levels are embedded in the document up to
+    lod_max_points points in total; with lod_file set, the remaining finer levels are written as
+    chunk files (lod_file + '<level>_<chunk>.bin', float64 times then float32 values) and fetched from
+    lod_url + '<level>_<chunk>.bin' as the user zooms, so the document size stays flat.
+    Plotted values are y*scale.
+
+    """
+    import os
+    import numpy as np
+
+    levels = []
+    embedded = 0
+    for k, (bin_len, idx, val) in enumerate(_minmax_pyramid(y, min_points=lod_points)):
+        pps = fs_plot*(2./bin_len if idx is not None else 1.)
+        npts = len(val)
+        if embedded + npts <= lod_max_points or k == 0:
+            embedded += npts
+            t = (idx if idx is not None else np.arange(npts))/fs_plot
+            src = bkm.ColumnDataSource(data=dict(t=t, y=np.asarray(val, dtype=np.float32)*scale))
+            levels.append(dict(pps=pps, src=src, url=None, chunk_dt=0, nchunks=0))
+        elif lod_file is not None:
+            lod_dir = os.path.dirname(lod_file)
+            if lod_dir and not os.path.isdir(lod_dir):
+                os.makedirs(lod_dir)
+            nchunks = -(-npts//lod_chunk)
+            for c in range(nchunks):
+                i = np.arange(c*lod_chunk, min((c+1)*lod_chunk, npts))
+                t = (idx[i] if idx is not None else i)/fs_plot
+                with open('%s%d_%d.bin' % (lod_file, k, c), 'wb') as f:
+                    f.write(t.astype('<f8').tobytes())
+                    f.write((np.asarray(val[i[0]:i[-1]+1], dtype='<f4')*scale).astype('<f4').tobytes())
+            url = '%s%d_{}.bin' % ((lod_url if lod_url is not None else lod_file.replace(os.sep, '/')), k)
+            levels.append(dict(pps=pps, src=None, url=url, chunk_dt=lod_chunk/pps, nchunks=nchunks))
+        else:
+            break
+
+    coarse = levels[0]['src'].data
+    source.data = dict(time_steps=coarse['t'], data=coarse['y'])
+    callback = bkm.CustomJS(args=dict(source=source, xr=plot.x_range, levels=levels, npoints=lod_points),
+                            code=_LOD_CALLBACK)
+    plot.x_range.js_on_change('start', callback)
+    plot.x_range.js_on_change('end', callback)
+    return levels
+
+
+
+def _lod_sonify(plot, source, y, fs_plot, lod_points, lod_max_points, audio_file=None, audio_url=None, scale=1.):
+    """
+    Attach the level-of-detail waveform to plot, keeping any chunk files next to audio_file.
+    lod_max_points=None embeds _LOD_EMBED_POINTS points when the finer levels can be written next
+    to audio_file, and up to 2**18 otherwise, as the page then holds every level that can be shown.
+
+    """
+    import os
+
+    if lod_max_points is None:
+        lod_max_points = _LOD_EMBED_POINTS if audio_file is not None else 2**18
+    lod_file = lod_url = None
+    if audio_file is not None:
+        lod_file = os.path.splitext(audio_file)[0] + '_lod'
+        lod_url = _sidecar_url(audio_file, audio_url, '_lod')
+    return _attach_lod(plot, source, y, fs_plot, lod_points=lod_points, lod_file=lod_file, lod_url=lod_url,
+                       lod_max_points=lod_max_points, scale=scale)
+
+
+# =================================
+# Spectrogram tiles: the spectrogram is stored as a pyramid of fixed-size tiles on disk. The page
+# embeds only the coarsest level and fetches the tiles covering the current view at the matching
+# resolution, drawing them over the coarse image as the user zooms and pans. Like the envelope
+# chunks, the tiles are loaded with fetch, which browsers block for pages opened from file://
+# URLs: serve the output directory over http, e.g. with python -m http.server.
+
+def _alloc_cells(shape, dtype, mem_cells=2**22):
+    """
+    Empty array of shape, memory-mapped to a temporary file if it has more than mem_cells cells.
+
+    """
+    import tempfile
+    import numpy as np
+
+    if np.prod(shape) <= mem_cells:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+
+
+def _spectrogram_axes(n, fs, nperseg=256, noverlap=None, nfft=None):
+    """
+    Frequencies and segment times of scipy.signal.spectrogram(x, fs, nperseg, noverlap, nfft)
+    for len(x) = n, along with the segment options it resolves (nperseg, noverlap, nfft).
+
+    """
+    import numpy as np
+
+    nperseg = min(nperseg, n)
+    noverlap = nperseg//8 if noverlap is None else noverlap
+    nfft = nperseg if nfft is None else nfft
+    hop = nperseg - noverlap
+    f = np.fft.rfftfreq(nfft, 1./fs)
+    t = (np.arange((n - nperseg)//hop + 1)*hop + nperseg/2.)/fs
+    return f, t, (nperseg, noverlap, nfft)
+
+
+def _spectrogram(data, fs, block_len=2**20, scale=1., out_file=None, mem_cells=2**22, **spec_opts):
+    """
+    f, t and the power spectral density in dB (float32, frequency x time) of data*scale, as
+    10*log10(scipy.signal.spectrogram(data*scale, fs, **spec_opts)). data is read in blocks of
+    whole segments, starting on multiples of the hop between segments, so the blocks give the same
+    columns as the whole trace and memory does not grow with len(data): amp_db is written to
+    out_file (a .npy file) or, past mem_cells cells, to a memory-mapped temporary file.
+
+    """
+    import numpy as np
+    from scipy import signal
+
+    f, t, (nperseg, noverlap, nfft) = _spectrogram_axes(len(data), fs, **spec_opts)
+    hop = nperseg - noverlap
+    shape = (len(f), len(t))
+    if out_file is not None:
+        amp_db = np.lib.format.open_memmap(out_file, mode='w+', dtype=np.float32, shape=shape)
+    else:
+        amp_db = _alloc_cells(shape, np.float32, mem_cells)
+    nseg = max(block_len//hop, 1)
+    for s0 in range(0, len(t), nseg):
+        s1 = min(s0+nseg, len(t))
+        x = np.asarray(data[s0*hop:(s1-1)*hop+nperseg], dtype=np.float64)*scale
+        _, _, Sxx = signal.spectrogram(x, fs, nperseg=nperseg, noverlap=noverlap, nfft=nfft)
+        amp_db[:, s0:s1] = 10*np.log10(np.abs(Sxx))
+    if out_file is not None:
+        amp_db.flush()
+    return f, t, amp_db
+
+
+def _spec_pyramid(amp_db, tile_size=256, block_cells=2**22, mem_cells=2**22):
+    """
+    Pyramid of amp_db (frequency x time, in dB), ordered from coarsest to finest level.
+    Each level is (fbin, tbin, amp): amp averages the power over cells of fbin x tbin cells of amp_db.
+    Every coarser level merges 2x2 cells of the level below (only along axes still longer than
+    one tile), and the coarsest level fits in a single tile_size x tile_size tile. Levels are
+    reduced from the level below in blocks of about block_cells cells, so amp_db can be
+    memory-mapped: levels of more than mem_cells cells are memory-mapped temporary files.
+
+    """
+    import numpy as np
+
+    amp = amp_db if amp_db.dtype == np.float32 else np.asarray(amp_db, dtype=np.float32)
+    levels = [(1, 1, amp)]
+    bins = [1, 1]
+    while max(amp.shape) > tile_size:
+        halve = [n > tile_size for n in amp.shape]
+        shape = tuple(-(-n//2) if h else n for n, h in zip(amp.shape, halve))
+        out = _alloc_cells(shape, np.float32, mem_cells)
+        # blocks of an even number of columns, so that no pair of columns is split
+        cols = max(block_cells//amp.shape[0]//2, 1)*2
+        for j0 in range(0, amp.shape[1], cols):
+            power = 10**(np.asarray(amp[:, j0:j0+cols], dtype=np.float64)/10)
+            for axis in (0, 1):
+                if halve[axis]:
+                    if power.shape[axis] % 2:
+                        # repeat the last row/column so every cell averages two
+                        power = np.concatenate([power, power.take([-1], axis=axis)], axis=axis)
+                    power = power.reshape(power.shape[:axis] + (-1, 2) + power.shape[axis+1:]).mean(axis=axis+1)
+            k0 = j0//2 if halve[1] else j0
+            out[:, k0:k0+power.shape[1]] = 10*np.log10(power)
+        bins = [b*2 if h else b for b, h in zip(bins, halve)]
+        amp = out
+        levels.append((bins[0], bins[1], amp))
+    return levels[::-1]
+
+
+_SPEC_TILE_CALLBACK = """
+// Pick the finest level that keeps the visible part of the spectrogram under ncells cells
+var x0 = Math.max(xr.start, spec.x0), x1 = Math.min(xr.end, spec.x0 + spec.dw);
+var y0 = Math.max(yr.start, spec.y0), y1 = Math.min(yr.end, spec.y0 + spec.dh);
+if (x1 <= x0 || y1 <= y0) { return; }
+var k = 0;
+for (var i = 0; i < levels.length; i++) {
+    if ((x1 - x0)/levels[i].cw <= ncells[0] && (y1 - y0)/levels[i].ch <= ncells[1]) { k = i; }
+}
+var cache = source.tile_cache || (source.tile_cache = {});
+function load(url, k) {
+    cache[url] = null;
+    fetch(url).then(function(r) {
+        if (!r.ok) { throw new Error(r.status + ' ' + r.statusText); }
+        return r.arrayBuffer();
+    }).then(function(buf) {
+        // tile file: float32 values, rows of increasing frequency
+        cache[url] = new Float32Array(buf);
+        xr.properties.start.change.emit();
+    }).catch(function(err) {
+        // forget the request so the next zoom or pan retries it, and show the next coarser level
+        // at hand meanwhile (the embedded coarsest level at least)
+        delete cache[url];
+        console.warn('Could not load ' + url + ': ' + err);
+        for (var j = k - 1; j >= 0 && !show(j, false); j--) {}
+    });
+}
+// Show level k, if all of its tiles covering the view have arrived; with fetch set, request
+// the missing tiles
+function show(k, fetch) {
+    if (k == 0) {
+        // the coarsest level is the embedded image underneath
+        source.data = {image: [], x: [], y: [], dw: [], dh: []};
+        return true;
+    }
+    var lev = levels[k];
+    var tx0 = Math.max(Math.floor((x0 - spec.x0)/(lev.cw*tile)), 0);
+    var tx1 = Math.min(Math.floor((x1 - spec.x0)/(lev.cw*tile)), lev.ntx - 1);
+    var ty0 = Math.max(Math.floor((y0 - spec.y0)/(lev.ch*tile)), 0);
+    var ty1 = Math.min(Math.floor((y1 - spec.y0)/(lev.ch*tile)), lev.nty - 1);
+    var missing = false;
+    for (var ty = ty0; ty <= ty1; ty++) {
+        for (var tx = tx0; tx <= tx1; tx++) {
+            var url = lev.url.replace('{x}', tx).replace('{y}', ty);
+            if (cache[url] === undefined && fetch) { load(url, k); }
+            if (cache[url] == null) { missing = true; }
+        }
+    }
+    if (missing) { return false; }
+    // Assemble the visible tiles into one image
+    var width = function(tx) { return Math.min(tile, lev.nt - tx*tile); };
+    var height = function(ty) { return Math.min(tile, lev.nf - ty*tile); };
+    var ncols = 0, nrows = 0;
+    for (var tx = tx0; tx <= tx1; tx++) { ncols += width(tx); }
+    for (var ty = ty0; ty <= ty1; ty++) { nrows += height(ty); }
+    var img = new Float32Array(nrows*ncols);
+    var r0 = 0;
+    for (var ty = ty0; ty <= ty1; ty++) {
+        var c0 = 0;
+        for (var tx = tx0; tx <= tx1; tx++) {
+            var vals = cache[lev.url.replace('{x}', tx).replace('{y}', ty)], w = width(tx);
+            for (var r = 0; r < height(ty); r++) {
+                img.set(vals.subarray(r*w, (r + 1)*w), (r0 + r)*ncols + c0);
+            }
+            c0 += w;
+        }
+        r0 += height(ty);
+    }
+    source.setv({_shapes: {image: [[nrows, ncols]]},
+                 data: {image: [img], x: [spec.x0 + tx0*tile*lev.cw], y: [spec.y0 + ty0*tile*lev.ch],
+                        dw: [ncols*lev.cw], dh: [nrows*lev.ch]}});
+    return true;
+}
+// keep showing what is there (the coarse image at least) until every tile has arrived
+show(k, true);
+"""
+
+
+def _attach_spec_tiles(plot, amp_db, x0, y0, dw, dh, tile_file, tile_url=None, tile_size=256,
+                       view_cells=(1024, 512), **image_options):
+    """
+    Plot amp_db (frequency x time) over x0..x0+dw and y0..y0+dh as a tiled pyramid.
+    The coarsest level is embedded as an image; finer levels are written as tile files
+    (tile_file + '<level>_<x>_<y>.bin', float32 rows of tile_size cells or fewer at the edges)
+    and fetched from tile_url + '<level>_<x>_<y>.bin' for the current view, using the finest level
+    that shows at most view_cells (time, frequency) cells. image_options go to plot.image
+    (e.g. color_mapper, which should be fixed so that every level is coloured the same).
+    The tiles are fetched over http, so this needs a web server even for static pages: opened
+    from a file:// URL the page only shows the coarsest level. Serve the page's directory with
+
+        python -m http.server 8000
+
+    and open http://localhost:8000/<page>.html. A failed tile is requested again on the next
+    zoom or pan, and the next coarser level is shown meanwhile.
+
+    """
+    import os
+    import numpy as np
+
+    tile_dir = os.path.dirname(tile_file)
+    if tile_dir and not os.path.isdir(tile_dir):
+        os.makedirs(tile_dir)
+    nf, nt = amp_db.shape
+    levels = []
+    for k, (fbin, tbin, amp) in enumerate(_spec_pyramid(amp_db, tile_size)):
+        lf, lt = amp.shape
+        ntx, nty = -(-lt//tile_size), -(-lf//tile_size)
+        if k > 0:
+            for ty in range(nty):
+                for tx in range(ntx):
+                    tile = amp[ty*tile_size:(ty+1)*tile_size, tx*tile_size:(tx+1)*tile_size]
+                    with open('%s%d_%d_%d.bin' % (tile_file, k, tx, ty), 'wb') as f:
+                        f.write(np.ascontiguousarray(tile, dtype='<f4').tobytes())
+        else:
+            plot.image(image=[amp], x=x0, y=y0, dw=dw, dh=dh, **image_options)
+        url = '%s%d_{x}_{y}.bin' % ((tile_url if tile_url is not None else tile_file.replace(os.sep, '/')), k)
+        # cell size of this level; cells at the top/right edges may reach a little past dw/dh
+        levels.append(dict(nt=lt, nf=lf, ntx=ntx, nty=nty, cw=dw/nt*tbin, ch=dh/nf*fbin, url=url))
+
+    source = bkm.ColumnDataSource(data=dict(image=[], x=[], y=[], dw=[], dh=[]))
+    plot.image(image='image', x='x', y='y', dw='dw', dh='dh', source=source, **image_options)
+    # Fixed ranges, so that swapping in the tiles does not re-fit them to the visible part
+    plot.y_range = bkm.Range1d(start=y0, end=y0+dh)
+    callback = bkm.CustomJS(args=dict(source=source, xr=plot.x_range, yr=plot.y_range, levels=levels,
+                                      spec=dict(x0=x0, y0=y0, dw=dw, dh=dh), tile=tile_size,
+                                      ncells=list(view_cells)),
+                            code=_SPEC_TILE_CALLBACK)
+    for rng in (plot.x_range, plot.y_range):
+        rng.js_on_change('start', callback)
+        rng.js_on_change('end', callback)
+    return levels
+
+
+# =================================
+# Profiling helpers: with profile=True the sonify functions record the wall time and the peak
+# memory allocated (traced with tracemalloc) by each stage, and return them with the layout.
+
+class _Stage(object):
+    """
+    Appends {'stage', 'seconds', 'peak_bytes'} for the code it wraps (as a context manager, or
+    between start() and stop()) to profile (a list), or does nothing if profile is None.
+    peak_bytes is the most memory allocated at any point during the stage on top of what was
+    allocated when it started.
+
+    """
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def start(self):
+        import time
+        import tracemalloc
+
+        if self.profile is not None:
+            self.tracing = tracemalloc.is_tracing()
+            if not self.tracing:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.mem0 = tracemalloc.get_traced_memory()[0]
+            self.t0 = time.perf_counter()
+        return self
+
+    def stop(self):
+        import time
+        import tracemalloc
+
+        if self.profile is not None:
+            seconds = time.perf_counter() - self.t0
+            peak = tracemalloc.get_traced_memory()[1]
+            if not self.tracing:
+                tracemalloc.stop()
+            self.profile.append(dict(stage=self.name, seconds=seconds, peak_bytes=max(peak - self.mem0, 0)))
+        return self.profile
+
+
+def _profile_serialize(grid, profile):
+    """
+    Time the html export of grid (as bokeh.io.save would write it) and record its size.
+
+    """
+    from bokeh.embed import file_html
+    from bokeh.resources import CDN
+
+    with _Stage(profile, 'serialize'):
+        html = file_html(grid, CDN, 'profile')
+    profile[-1]['bytes'] = len(html.encode('utf-8'))
+    return profile
+
+
 class AudioPlayerModel(bkm.layouts.WidgetBox):
     """
     Audio player using https://howlerjs.com/.
@@ -40,7 +822,7 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
             @audio_ext = if @audio_ext == '.x-wav' then '.wav' else @audio_ext
             @connect(@model.play_pause_button.properties.active.change, @play_pause_press)
             @connect(@model.stop_button.properties.clicks.change, @stop)
-            @connect(@model.download_button.properties.clicks.change, () => download(@model.audio_source, @model.default_title.value + @audio_ext, @audio_mime_type))
+            @connect(@model.download_button.properties.clicks.change, @download_audio)
             @connect(@model.seek_bar.properties.value.change, () => @audio.seek(@model.seek_bar.value) if not @audio.playing())
             @connect(@model.volume_bar.properties.value.change, () => @audio.volume(@model.volume_bar.value))
 
@@ -54,6 +836,13 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
         pause: () =>
             @audio.pause()
 
+        download_audio: () =>
+            if @model.audio_source.startsWith('data:')
+                download(@model.audio_source, @model.default_title.value + @audio_ext, @audio_mime_type)
+            else
+                # audio is served as a separate file: let download.js fetch it by URL
+                download(@model.audio_source)
+
         stop: () =>
             @audio.stop()
             @step()
@@ -88,7 +877,7 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
 
     """
 
-    audio_source = bkc.properties.String(help="Audio file or base64 encoded file with header.")
+    audio_source = bkc.properties.String(help="URL of an audio file (wav, ogg or flac) or base64 encoded file with header.")
     default_title = bkc.properties.Instance(bkm.widgets.TextInput, help="Audio player default_title, also used as download filename.")
     play_pause_button = bkc.properties.Instance(bkm.widgets.Toggle, help="Toggle used to control audio playback.")
     stop_button = bkc.properties.Instance(bkm.widgets.Button, help="Button used to halt audio playback.")
@@ -111,46 +900,113 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
                        seek_bar_alpha=0.4,
                        seek_bar_throttle=15,  # milliseconds
                        time_series_start=0,  # offset in seconds
-                       tools=['save','box_zoom','xwheel_zoom','ywheel_zoom','reset','crosshair','pan']
+                       tools=['save','box_zoom','xwheel_zoom','ywheel_zoom','reset','crosshair','pan'],
+                       stream=False,  # resample and write audio in blocks (for very long records)
+                       wav_path=None,  # where to write the streamed wav file (temporary file if None)
+                       block_len=2**20,  # samples per block when stream=True
+                       audio_file=None,  # write audio to this .wav/.ogg/.flac file instead of embedding it
+                       audio_url=None,  # URL the page loads audio_file from (defaults to audio_file)
+                       lod_points=None,  # plot a min/max envelope with this many points per view
+                       lod_max_points=None,  # envelope points embedded in the page (default: ~4 per pixel with audio_file)
+                       cache_dir=None,  # reuse resampled audio (and spectrograms) cached in this directory
+                       cache_max_bytes=2**30,  # evict least recently used cache entries past this size
+                       profile=False,  # also return wall time and peak memory of every stage
+                       resampler='auto',  # 'poly' (polyphase FIR), 'resampy' or 'auto' (see resampling.py)
+                       resample_quality='medium',  # 'fast', 'medium' or 'best'
+                       data_dis_scale=1.,  # plot data_dis*data_dis_scale (scaled block by block with stream=True)
                        ):
         """
         Sonify data and plot waveforms.
-        data vector should be numpy array
+        data vector should be numpy array (a memory-mapped array is fine with stream=True)
+
+        With stream=True the audio is resampled in overlapping blocks, normalized by the
+        global peak of data and written straight to a wav file, so memory use for the
+        audio does not grow with the length of the record.
+
+        With audio_file set, the audio is written to that file (.wav, or .ogg/.flac encoded
+        with soundfile) and the player loads it from audio_url instead of an embedded
+        base64 string. audio_url defaults to audio_file, so give a path relative to
+        where the html page will be saved.
+
+        With lod_points set, the waveform is drawn from a min/max envelope pyramid with
+        about lod_points points in view, and finer levels are swapped in on zoom. Levels
+        beyond lod_max_points are written next to audio_file and fetched on demand (or
+        dropped if there is no audio_file), so the page size does not grow with the data.
+        By default only about 4 points per pixel are embedded when there is an audio_file.
+        The chunk files are fetched over http, which browsers block for file:// pages, so
+        serve the page (e.g. python -m http.server) to zoom past the embedded levels.
+
+        With cache_dir set, the resampled 16 bit PCM is stored on disk under a hash of data
+        and the sonification parameters and reused on later calls. Least recently used
+        entries are removed once the cache grows past cache_max_bytes.
+
+        With profile=True, returns (grid, stages) instead of grid: stages is a list of dicts
+        with the wall time ('seconds') and peak memory allocated ('peak_bytes') of every
+        stage (resample, pcm, wav_write, base64 or audio when it goes through a file,
+        waveform_plot and serialize, which also holds the html size in 'bytes').
+
+        The audio is resampled from the playback rate of data to fs_resamp by a rational ratio
+        up/down, with a polyphase FIR by default (resampler='poly'/'auto') or with resampy
+        (resampler='resampy'); resample_quality trades speed for filter sharpness. The playback
+        rate is set to fs_resamp*down/up, so the audio lasts TargetDuration to within a fraction
+        of a percent and the sonified time axis matches it exactly.
         
         """
         import numpy as np
         from scipy.io import wavfile
-        import resampy
         import base64
         from io import BytesIO
         from bokeh.plotting import figure
         from bokeh.layouts import layout
         import BokehAudioPlayer
+        import resampling
 
+        stages = [] if profile else None
         # Seismogram duration
         duration = len(data)/fs
-        # Frequency of desired trace
-        fs_sound = int(fs*duration/TargetDuration)
+        # Frequency of desired trace, adjusted to the exact rational ratio the audio is resampled by
+        resampler = resampling.Resampler(fs*duration/TargetDuration, fs_resamp, method=resampler,
+                                         quality=resample_quality)
+        fs_sound = resampler.fs_in
         
         # Build time vector
         # time_steps_sound = np.linspace(0, data.size / fs_sound, data.size)
-        time_steps = np.arange(0, TargetDuration, 1./fs_sound)  # time vector for sounds
-        time_steps_true = np.arange(0, duration, 1./fs)  # time vector for true data
+        if lod_points is None:
+            time_steps = np.arange(len(data))/fs_sound  # time vector for sounds
+        else:
+            time_steps = np.array([0, (len(data)-1)/fs_sound])  # first and last sonified time (the envelope has its own)
+        time_steps_true = np.array([0, (len(data)-1)/fs])  # first and last time of true data
         
-        # AudioPlayerModel can only accept wav files... we can get around this by writing the
-        # waveform to a binary object in memory that looks like a wav file
-        # Resample only for sake of sonification (plotting resampled waveform can be very laggy...)    
-        datar = resampy.resample(data, fs_sound, fs_resamp)
-        # Write data array to memory
-        byte_io = BytesIO(bytes())
-        # Convert to 16 bit PCM (again, AudioPlayerModel is finicky)
-        data_16bitPCM = (datar/np.amax(np.absolute(datar))*32767).astype(np.int16)
-        wavfile.write(byte_io, fs_resamp, data_16bitPCM)
-        # Create base64-encoded data URI wav string (could also be a path to a wav file or a URL)
-        audio_source = 'data:audio/wav;base64,'+base64.b64encode(byte_io.read()).decode('UTF-8')  # link or base64-encoded wavefile string
-        # byte_io.read()
+        if stream or audio_file is not None or cache_dir is not None:
+            # Resample and convert to 16 bit PCM block by block (stream) or reuse cached PCM (cache_dir),
+            # writing the audio either as a separate file the player loads by URL (audio_file), which keeps
+            # the html page small and lets several players share one cached file, or to a wav file to embed
+            # (resampling, PCM conversion and writing are interleaved here, so they are profiled as one stage)
+            with _Stage(stages, 'audio'):
+                audio_source = _sonify_audio(data, fs, TargetDuration, resampler, stream=stream,
+                                             block_len=block_len, wav_path=wav_path, audio_file=audio_file,
+                                             audio_url=audio_url, cache_dir=cache_dir,
+                                             cache_max_bytes=cache_max_bytes)
+        else:
+            # AudioPlayerModel can only accept wav files... we can get around this by writing the
+            # waveform to a binary object in memory that looks like a wav file
+            # Resample only for sake of sonification (plotting resampled waveform can be very laggy...)    
+            with _Stage(stages, 'resample'):
+                datar = resampler.resample(data)
+            # Write data array to memory
+            byte_io = BytesIO(bytes())
+            # Convert to 16 bit PCM (again, AudioPlayerModel is finicky)
+            with _Stage(stages, 'pcm'):
+                data_16bitPCM = (datar/np.amax(np.absolute(datar))*32767).astype(np.int16)
+            with _Stage(stages, 'wav_write'):
+                wavfile.write(byte_io, fs_resamp, data_16bitPCM)
+            # Create base64-encoded data URI wav string (could also be a path to a wav file or a URL)
+            with _Stage(stages, 'base64'):
+                audio_source = 'data:audio/wav;base64,'+base64.b64encode(byte_io.read()).decode('UTF-8')  # link or base64-encoded wavefile string
+            # byte_io.read()
 
         # Bokeh Player setup - this is from a larger project, please forgive the weird syntax that's taken out of context
+        plot_stage = _Stage(stages, 'waveform_plot').start()
         player_options = {}
         player_options.setdefault("default_title", bkm.widgets.TextInput(value=default_title, title="", width=150, sizing_mode='scale_width'))
         player_options.setdefault("play_pause_button", bkm.widgets.Toggle(label="Play", width=100, button_type="success"))
@@ -167,13 +1023,19 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
         player = BokehAudioPlayer.AudioPlayerModel(**player_options)
 
         # Bokeh Plot setup
-        source = bkm.ColumnDataSource(data={'time_steps':time_steps, 'data':data_dis})
+        if lod_points is None:
+            source = bkm.ColumnDataSource(data={'time_steps':time_steps, 'data':data_dis*data_dis_scale if data_dis_scale != 1 else data_dis})
+        else:
+            source = bkm.ColumnDataSource(data={'time_steps':[], 'data':[]})
         time_series_plot = figure(plot_width=plot_width, plot_height=plot_height, sizing_mode='scale_width',
                                   x_range=(time_steps.min(),time_steps.max()),
                                   title=title, x_axis_label=x_axis_label, y_axis_label=y_axis_label,
                                   tools=tools)
         # Add second x-axis showing true time in hours
         time_series_plot.line('time_steps', 'data', source=source)
+        if lod_points is not None:
+            _lod_sonify(time_series_plot, source, data_dis, fs_sound, lod_points, lod_max_points, audio_file, audio_url,
+                        scale=data_dis_scale)
         time_series_plot.extra_x_ranges = {"true_time": bkm.Range1d(
                                            start=time_steps_true[0]/3600,
                                            end=time_steps_true[-1]/3600)}
@@ -193,7 +1055,10 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
 
         grid = layout([[time_series_plot, player]])
         grid.sizing_mode = 'scale_width'
+        plot_stage.stop()
         
+        if profile:
+            return grid, _profile_serialize(grid, stages)
         return grid
         
         
@@ -224,50 +1089,111 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
                        is_ytrue = True,
                        time_true_factor = 3600,  # Default to hours
                        high_res_spec = False,
+                       stream=False,  # resample and write audio in blocks (for very long records)
+                       wav_path=None,  # where to write the streamed wav file (temporary file if None)
+                       block_len=2**20,  # samples per block when stream=True
+                       audio_file=None,  # write audio to this .wav/.ogg/.flac file instead of embedding it
+                       audio_url=None,  # URL the page loads audio_file from (defaults to audio_file)
+                       lod_points=None,  # plot a min/max envelope with this many points per view
+                       lod_max_points=None,  # envelope points embedded in the page (default: ~4 per pixel with audio_file)
+                       cache_dir=None,  # reuse resampled audio (and spectrograms) cached in this directory
+                       cache_max_bytes=2**30,  # evict least recently used cache entries past this size
+                       spec_tile_size=None,  # store the spectrogram as tiles of this many cells (needs audio_file)
+                       spec_view_cells=(1024, 512),  # most (time, frequency) cells drawn for one view
+                       profile=False,  # also return wall time and peak memory of every stage
+                       resampler='auto',  # 'poly' (polyphase FIR), 'resampy' or 'auto' (see resampling.py)
+                       resample_quality='medium',  # 'fast', 'medium' or 'best'
+                       data_dis_scale=1.,  # plot data_dis*data_dis_scale (scaled block by block with stream=True)
                        ):
         """
         Sonify data and plot waveform as well as spectrogram.
-        data vector should be numpy array
+        data vector should be numpy array (a memory-mapped array is fine with stream=True)
+
+        With stream=True the audio is resampled in overlapping blocks and written straight
+        to a wav file. With audio_file set, the audio is saved as a separate file and
+        loaded by URL instead of embedded in the page. lod_points draws the waveform
+        from a min/max envelope pyramid that refines on zoom. cache_dir keeps the resampled
+        audio and the spectrogram (f, t and dB image, keyed on data_dis and nperseg/noverlap/nfft)
+        on disk for reuse (see sonify_plotwf).
+        With spec_tile_size set, only the coarsest level of a spectrogram tile pyramid is
+        embedded; the tiles for the current view are written next to audio_file and loaded
+        at the matching resolution on zoom, so high_res_spec no longer makes the page heavy.
+        Like the lod_points chunk files, the tiles are fetched over http: serve the page with
+        a web server (e.g. python -m http.server) rather than opening it as a file.
+        The spectrogram is computed block by block and memory-mapped when large, so with
+        stream=True memory stays bounded if spec_tile_size is set too (otherwise the whole
+        image is embedded in the page).
+        profile=True returns (grid, stages) as in sonify_plotwf, with spectrogram and
+        spectrogram_plot stages as well. resampler and resample_quality pick the resampling
+        filter (see sonify_plotwf).
         
         """
         import numpy as np
         from scipy.io import wavfile
-        import resampy
         import base64
         from io import BytesIO
         from bokeh.plotting import figure
         from bokeh.layouts import layout
         import BokehAudioPlayer
+        import resampling
         from scipy import signal
         from scipy.interpolate import interp2d
+        import os
         
-        # Ensure data is normalized
-        data = data / np.amax(np.abs(data))
+        stages = [] if profile else None
+        # Ensure data is normalized (when streaming, data is left as is, e.g. memory-mapped on disk,
+        # and scaled by data_scale wherever it is read)
+        if stream:
+            data_scale = 1./_global_peak(data, block_len)
+        else:
+            data = data / np.amax(np.abs(data))
+            data_scale = 1.
 
         # Seismogram duration
         duration = len(data)/fs
-        # Frequency of desired trace
-        fs_sound = int(fs*duration/TargetDuration)
+        # Frequency of desired trace, adjusted to the exact rational ratio the audio is resampled by
+        resampler = resampling.Resampler(fs*duration/TargetDuration, fs_resamp, method=resampler,
+                                         quality=resample_quality)
+        fs_sound = resampler.fs_in
         
         # Build time vector
         # time_steps_sound = np.linspace(0, data.size / fs_sound, data.size)
-        time_steps = np.arange(0, TargetDuration, 1./fs_sound)  # time vector for sounds
-        time_steps_true = np.arange(0, duration, 1./fs)  # time vector for true data
+        if lod_points is None:
+            time_steps = np.arange(len(data))/fs_sound  # time vector for sounds
+        else:
+            time_steps = np.array([0, (len(data)-1)/fs_sound])  # first and last sonified time (the envelope has its own)
+        time_steps_true = np.array([0, (len(data)-1)/fs])  # first and last time of true data
         
-        # AudioPlayerModel can only accept wav files... we can get around this by writing the
-        # waveform to a binary object in memory that looks like a wav file
-        # Resample only for sake of sonification (plotting resampled waveform can be very laggy...)    
-        datar = resampy.resample(data, fs_sound, fs_resamp)
-        # Write data array to memory
-        byte_io = BytesIO(bytes())
-        # Convert to 16 bit PCM (again, AudioPlayerModel is finicky)
-        data_16bitPCM = (datar/np.amax(np.absolute(datar))*32767).astype(np.int16)
-        wavfile.write(byte_io, fs_resamp, data_16bitPCM)
-        # Create base64-encoded data URI wav string (could also be a path to a wav file or a URL)
-        audio_source = 'data:audio/wav;base64,'+base64.b64encode(byte_io.read()).decode('UTF-8')  # link or base64-encoded wavefile string
-        # byte_io.read()
+        if stream or audio_file is not None or cache_dir is not None:
+            # Resample and convert to 16 bit PCM block by block (stream) or reuse cached PCM (cache_dir),
+            # writing the audio either as a separate file the player loads by URL (audio_file), which keeps
+            # the html page small and lets several players share one cached file, or to a wav file to embed
+            # (resampling, PCM conversion and writing are interleaved here, so they are profiled as one stage)
+            with _Stage(stages, 'audio'):
+                audio_source = _sonify_audio(data, fs, TargetDuration, resampler, stream=stream,
+                                             block_len=block_len, wav_path=wav_path, audio_file=audio_file,
+                                             audio_url=audio_url, cache_dir=cache_dir,
+                                             cache_max_bytes=cache_max_bytes)
+        else:
+            # AudioPlayerModel can only accept wav files... we can get around this by writing the
+            # waveform to a binary object in memory that looks like a wav file
+            # Resample only for sake of sonification (plotting resampled waveform can be very laggy...)    
+            with _Stage(stages, 'resample'):
+                datar = resampler.resample(data)
+            # Write data array to memory
+            byte_io = BytesIO(bytes())
+            # Convert to 16 bit PCM (again, AudioPlayerModel is finicky)
+            with _Stage(stages, 'pcm'):
+                data_16bitPCM = (datar/np.amax(np.absolute(datar))*32767).astype(np.int16)
+            with _Stage(stages, 'wav_write'):
+                wavfile.write(byte_io, fs_resamp, data_16bitPCM)
+            # Create base64-encoded data URI wav string (could also be a path to a wav file or a URL)
+            with _Stage(stages, 'base64'):
+                audio_source = 'data:audio/wav;base64,'+base64.b64encode(byte_io.read()).decode('UTF-8')  # link or base64-encoded wavefile string
+            # byte_io.read()
 
         # Bokeh Player setup - this is from a larger project, please forgive the weird syntax that's taken out of context
+        plot_stage = _Stage(stages, 'waveform_plot').start()
         player_options = {}
         player_options.setdefault("default_title", bkm.widgets.TextInput(value=default_title, title="", width=100, sizing_mode='scale_width'))
         player_options.setdefault("play_pause_button", bkm.widgets.Toggle(label="Play", width=50, button_type="success"))
@@ -284,40 +1210,80 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
         player = BokehAudioPlayer.AudioPlayerModel(**player_options)
 
         # Bokeh Plot setup
-        source = bkm.ColumnDataSource(data=dict(time_steps=time_steps, data=data))
+        if lod_points is None:
+            source = bkm.ColumnDataSource(data=dict(time_steps=time_steps, data=data*data_scale if stream else data))
+        else:
+            source = bkm.ColumnDataSource(data=dict(time_steps=[], data=[]))
         
         # Setup time series
         time_series_plot = figure(
                                   aspect_ratio=aspect_ratio, sizing_mode='scale_width',
                                   # plot_width=plot_width, plot_height=plot_height, sizing_mode='scale_width',
                                   x_range=(time_steps.min(),time_steps.max()),
-                                  y_range=(-np.amax(np.abs(data))*1.05,np.amax(np.abs(data))*1.05),
+                                  y_range=(-1.05,1.05),  # data is normalized
                                   title=title, y_axis_label=ywav_axis_label,
                                   # tools=tools, toolbar_location='right',
                                   toolbar_location=None,
                                   )
         # Plot time series object
         time_series_plot.line('time_steps', 'data', source=source)
+        if lod_points is not None:
+            _lod_sonify(time_series_plot, source, data, fs_sound, lod_points, lod_max_points, audio_file, audio_url,
+                        scale=data_scale)
         # Add y axis showing true displacement
         if is_ytrue:
+            dis_peak = _global_peak(data_dis, block_len)*abs(data_dis_scale)
             time_series_plot.extra_y_ranges = {"data_dis": bkm.Range1d(
-                                   start=-np.amax(np.abs(data_dis))*1.05,
-                                   end=np.amax(np.abs(data_dis))*1.05)}
+                                   start=-dis_peak*1.05,
+                                   end=dis_peak*1.05)}
             time_series_plot.add_layout(bkm.LinearAxis(y_range_name="data_dis",axis_label=ywav_axis_label_true),'left')
         
+        plot_stage.stop()
+
         # Spectrogram
+        spec_stage = _Stage(stages, 'spectrogram').start()
+        if spec_tile_size is not None and audio_file is None:
+            raise ValueError("spec_tile_size needs audio_file: the tiles are written next to it")
         if high_res_spec == True:
             nperseg = int(0.01*fs_sound*TargetDuration) # The length of each frame (should be expressed in samples)
             noverlap = int(nperseg*0.7) # The overlapping between successive frames (should be expressed in samples)
             nfft = int(nperseg*2)
-            f, t, Sxx = signal.spectrogram(data_dis, fs_sound, nperseg=nperseg, noverlap=noverlap, nfft=nfft)
+            spec_opts = dict(nperseg=nperseg, noverlap=noverlap, nfft=nfft)
+        else:
+            spec_opts = {}
+        spec_path = None
+        if cache_dir is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            spec_key = _cache_key(data_dis, 'spec', block_len=block_len, fs_sound=fs_sound, scale=data_dis_scale,
+                                  **spec_opts)
+            spec_path = _cache_get(cache_dir, spec_key, '.npy')
+        if spec_path is not None:
+            f, t, _ = _spectrogram_axes(len(data_dis), fs_sound, **spec_opts)
+            amp_db = np.load(spec_path, mmap_mode='r')
         else:
-            f, t, Sxx = signal.spectrogram(data_dis, fs_sound)            
-        # T = np.linspace(1/f[-1],1/f[1],len(f))
-        # ip = interp2d(t, f, Sxx); zi = ip(t, T)
-        # Sxx = zi
-        # f = T
-        amp_db = 10*np.log10(np.abs(Sxx))
+            # Computed block by block (and memory-mapped past a few million cells), so a long
+            # streamed record does not hold its whole spectrogram in memory
+            out_file = None if cache_dir is None else _cache_tmp(cache_dir, spec_key, '.npy')
+            try:
+                f, t, amp_db = _spectrogram(data_dis, fs_sound, block_len=block_len, scale=data_dis_scale,
+                                            out_file=out_file, **spec_opts)
+            except BaseException:
+                if out_file is not None:
+                    os.remove(out_file)
+                raise
+            # T = np.linspace(1/f[-1],1/f[1],len(f))
+            # ip = interp2d(t, f, Sxx); zi = ip(t, T)
+            # Sxx = zi
+            # f = T
+            if cache_dir is not None:
+                spec_path = os.path.join(cache_dir, spec_key + '.npy')
+                del amp_db
+                os.replace(out_file, spec_path)
+                _cache_evict(cache_dir, cache_max_bytes, keep=spec_path)
+                amp_db = np.load(spec_path, mmap_mode='r')
+        spec_stage.stop()
+        plot_stage = _Stage(stages, 'spectrogram_plot').start()
         TOOLS = "hover,save,pan,box_zoom,reset,xwheel_zoom,ywheel_zoom,crosshair"
         spec_plot = figure(
                        aspect_ratio=aspect_ratio, sizing_mode='scale_width',
@@ -326,14 +1292,21 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
                        # tools=TOOLS, toolbar_location='right',
                        toolbar_location=None,
                        tooltips=[('Power', '@image log(dB/Hz)')])
-        spec_plot.image(image=[amp_db], x=t.min(), y=f.min(), 
-                   dw=t.max(), dh=f.max(), palette=palette)
-        # spec_plot.x_range.range_padding = spec_plot.y_range.range_padding = 0
-        spec_plot.y_range.range_padding = 0
-        spec_plot.x_range = time_series_plot.x_range
         # Add colorbar
-        mapper_opts = dict(palette=palette, low=amp_db.min(), high=amp_db.max())
+        mapper_opts = dict(palette=palette, low=float(amp_db.min()), high=float(amp_db.max()))
         color_mapper = bkm.LinearColorMapper(**mapper_opts)
+        if spec_tile_size is None:
+            spec_plot.image(image=[amp_db], x=t.min(), y=f.min(), 
+                       dw=t.max(), dh=f.max(), palette=palette)
+            # spec_plot.x_range.range_padding = spec_plot.y_range.range_padding = 0
+            spec_plot.y_range.range_padding = 0
+            spec_plot.x_range = time_series_plot.x_range
+        else:
+            # Tile pyramid next to the audio file, coloured with the colorbar's fixed mapper
+            spec_plot.x_range = time_series_plot.x_range
+            _attach_spec_tiles(spec_plot, amp_db, t.min(), f.min(), t.max(), f.max(),
+                               os.path.splitext(audio_file)[0] + '_spec', _sidecar_url(audio_file, audio_url, '_spec'),
+                               tile_size=spec_tile_size, view_cells=spec_view_cells, color_mapper=color_mapper)
         color_bar = bkm.ColorBar(color_mapper=color_mapper, 
                              ticker=spec_plot.xaxis.ticker, formatter=spec_plot.xaxis.formatter,
                              location=(0,0), orientation='vertical', padding=5, width=20)
@@ -348,7 +1321,8 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
             spec_plot.add_layout(bkm.LinearAxis(x_range_name="true_time",axis_label=x_axis_label_true),'below')
         # add second y range for true frequency
         if is_ytrue:
-            f_tru, t_tru, Sxx_tru = signal.spectrogram(data_dis, fs)
+            # True frequencies are the sonified ones scaled back by the speed-up factor
+            f_tru = f*fs/fs_sound
             spec_plot.extra_y_ranges = {"true_freq": bkm.Range1d(
                                    start=f_tru[0],
                                    end=f_tru[-1])}
@@ -395,5 +1369,391 @@ class AudioPlayerModel(bkm.layouts.WidgetBox):
                       # [[time_series_plot, player], spec_plot],
                       [[[toolbar_box, time_series_plot, spec_plot], player]],
                       sizing_mode='scale_width')
+        plot_stage.stop()
+        
+        if profile:
+            return grid, _profile_serialize(grid, stages)
+        return grid
         
-        return grid
\ No newline at end of file
+        
+# =================================
+
+class MultiAudioPlayerModel(bkm.layouts.WidgetBox):
+    """
+    Audio player for several traces sharing one audio file, using https://howlerjs.com/ sprites.
+    Every trace is a sprite (channel) of the same file; the selected channels play together
+    from the one decoded buffer, mixed at equal volume, and a single animation loop moves the
+    seek bar, which drives the seek bar spans of all the linked plots.
+
+    """
+
+    __javascript__ = AudioPlayerModel.__javascript__
+
+    __implementation__ = """
+    import * as p from "core/properties"
+    import {WidgetBox, WidgetBoxView} from "models/layouts/widget_box"
+
+    export class MultiAudioPlayerView extends WidgetBoxView
+
+        initialize: (options) ->
+            super(options)
+            @audio = new Howl({src: [@model.audio_source], sprite: @model.sprites})
+            @ids = {}  # sound id of every channel playing
+            @position = 0  # seconds into the traces when nothing is playing
+            @audio.on('load', () => @model.seek_bar.end = @duration())
+            @audio.on('end', () => @stop())
+            @audio_mime_type = if @model.audio_source.includes(';base64,') then @model.audio_source.split(';base64,')[0].split(':')[1] else "text/plain"
+            @audio_ext = if @audio_mime_type == "text/plain" then "_link.txt" else "." + @audio_mime_type.split("/")[1]
+            @audio_ext = if @audio_ext == '.x-wav' then '.wav' else @audio_ext
+            @connect(@model.play_pause_button.properties.active.change, @play_pause_press)
+            @connect(@model.stop_button.properties.clicks.change, @stop)
+            @connect(@model.download_button.properties.clicks.change, @download_audio)
+            @connect(@model.channel_select.properties.active.change, @update_channels)
+            @connect(@model.seek_bar.properties.value.change, () => @position = @model.seek_bar.value if not @playing())
+            @connect(@model.volume_bar.properties.value.change, @update_volumes)
+
+        duration: () =>
+            Math.min.apply(null, (@model.sprites[c][1]/1000 for c in @model.channels))
+
+        selected: () =>
+            (@model.channels[i] for i in @model.channel_select.active)
+
+        playing: () =>
+            for c, id of @ids
+                return true if @audio.playing(id)
+            false
+
+        current_position: () =>
+            for c, id of @ids
+                return @audio.seek(id) - @model.sprites[c][0]/1000
+            @position
+
+        start_channel: (c, position) =>
+            id = @audio.play(c)
+            @audio.seek(@model.sprites[c][0]/1000 + position, id)
+            @ids[c] = id
+
+        stop_channels: () =>
+            @audio.stop(id) for c, id of @ids
+            @ids = {}
+
+        update_channels: () =>
+            # switch channels in and out at the current position while playing
+            return if Object.keys(@ids).length == 0
+            position = @current_position()
+            selected = @selected()
+            for c, id of @ids
+                if c not in selected
+                    @audio.stop(id)
+                    delete @ids[c]
+            @start_channel(c, position) for c in selected when c not of @ids
+            @update_volumes()
+            @pause() if Object.keys(@ids).length == 0
+
+        update_volumes: () =>
+            n = Math.max(Object.keys(@ids).length, 1)
+            @audio.volume(@model.volume_bar.value/n, id) for c, id of @ids
+
+        play: () =>
+            if @audio.state() == "loaded" and @selected().length > 0
+                @start_channel(c, @position) for c in @selected()
+                @update_volumes()
+                @model.play_pause_button.label = "Pause"
+                @step()
+            else
+                @model.play_pause_button.active = false
+
+        pause: () =>
+            @position = @current_position()
+            @stop_channels()
+            @model.play_pause_button.label = "Play"
+            @model.play_pause_button.active = false
+
+        stop: () =>
+            @stop_channels()
+            @position = 0
+            @model.play_pause_button.label = "Play"
+            @model.play_pause_button.active = false
+            @update_seek_bar()
+
+        download_audio: () =>
+            if @model.audio_source.startsWith('data:')
+                download(@model.audio_source, @model.default_title.value + @audio_ext, @audio_mime_type)
+            else
+                download(@model.audio_source)
+
+        play_pause_press: () =>
+            if @model.play_pause_button.active
+                @play() if not @playing()
+            else
+                @pause() if @playing()
+
+        update_seek_bar: () =>
+            @model.seek_bar.value = @current_position()
+
+        step: () =>
+            # the one animation loop for all channels and plots
+            @update_seek_bar()
+            if @playing()
+                requestAnimationFrame(@step)
+
+    export class MultiAudioPlayerModel extends WidgetBox
+        default_view: MultiAudioPlayerView
+        type: "MultiAudioPlayerModel"
+
+        @define {
+            audio_source:       [p.String, ]
+            sprites:            [p.Any, ]
+            channels:           [p.Array, ]
+            channel_select:     [p.Any, ]
+            default_title:      [p.Any, ]
+            play_pause_button:  [p.Any, ]
+            stop_button:        [p.Any, ]
+            download_button:    [p.Any, ]
+            seek_bar:           [p.Any, ]
+            volume_bar:         [p.Any, ]
+        }
+
+    """
+
+    audio_source = bkc.properties.String(help="URL of an audio file (wav, ogg or flac) or base64 encoded file with header, holding every channel.")
+    sprites = bkc.properties.Dict(bkc.properties.String, bkc.properties.List(bkc.properties.Float), help="Offset and duration (ms) of every channel in the audio file.")
+    channels = bkc.properties.List(bkc.properties.String, help="Sprite names, in the order of the channel_select labels.")
+    channel_select = bkc.properties.Instance(bkm.widgets.CheckboxButtonGroup, help="Buttons selecting the channels to play (mixed when several are active).")
+    default_title = bkc.properties.Instance(bkm.widgets.TextInput, help="Audio player default_title, also used as download filename.")
+    play_pause_button = bkc.properties.Instance(bkm.widgets.Toggle, help="Toggle used to control audio playback.")
+    stop_button = bkc.properties.Instance(bkm.widgets.Button, help="Button used to halt audio playback.")
+    download_button = bkc.properties.Instance(bkm.widgets.Button, help="Button used to download audio file.")
+    seek_bar = bkc.properties.Instance(bkm.widgets.Slider, help="Seek bar to control playback.")
+    volume_bar = bkc.properties.Instance(bkm.widgets.Slider, help="Volume bar to control playback gain.")
+
+    def sonify_compare( data_list, fs,  # traces to sonify (fs: one sample rate or one per trace)
+                        data_dis_list,  # traces to plot
+                        TargetDuration,  # duration of every sonified waveform
+                        default_title,  # will become output file name
+                        titles,  # one plot title (and channel label) per trace
+                        fs_resamp=44100,
+                        x_axis_label='Sonified Time (seconds)',
+                        x_axis_label_true='True Time (hours)',
+                        y_axis_label='Displacement (mm)',
+                        plot_width=800, plot_height=250,
+                        seek_bar_color='red',
+                        seek_bar_width=3,
+                        seek_bar_alpha=0.4,
+                        seek_bar_throttle=15,  # milliseconds
+                        time_series_start=0,  # offset in seconds
+                        tools=['save','box_zoom','xwheel_zoom','ywheel_zoom','reset','crosshair','pan'],
+                        active=(0,),  # channels selected at first
+                        normalize='each',  # 'each' trace to its own peak, or 'common' peak to compare amplitudes
+                        gap=0.25,  # seconds of silence between channels in the audio file
+                        stream=False,  # resample and write audio in blocks (for very long records)
+                        block_len=2**20,  # samples per block when stream=True
+                        audio_file=None,  # write audio to this .wav/.ogg/.flac file instead of embedding it
+                        audio_url=None,  # URL the page loads audio_file from (defaults to audio_file)
+                        resampler='auto',  # 'poly' (polyphase FIR), 'resampy' or 'auto' (see resampling.py)
+                        resample_quality='medium',  # 'fast', 'medium' or 'best'
+                        ):
+        """
+        Sonify several traces (e.g. one event recorded at several stations) into one audio file and
+        plot their waveforms one above the other with a shared time axis. The player plays the
+        traces selected with its channel buttons, mixed together, in sync with one seek bar span
+        on every plot. normalize='common' keeps the relative amplitudes of the traces.
+        Traces may have different sample rates (fs, one per trace) but must cover the same true
+        duration, so that a sonified second means the same true time on every plot.
+
+        """
+        import itertools
+        import numpy as np
+        from bokeh.plotting import figure
+        from bokeh.layouts import layout, column
+        import BokehAudioPlayer
+        import resampling
+
+        fs_list = list(fs) if np.iterable(fs) else [fs]*len(data_list)
+        durations = [len(data)/float(fs_i) for data, fs_i in zip(data_list, fs_list)]
+        if max(durations) > min(durations)*1.01:
+            raise ValueError("traces span %s s: they must cover the same true duration to share a time axis"
+                             % ', '.join('%g' % d for d in durations))
+        peaks = [_global_peak(data, block_len) for data in data_list]
+        scales = [1./peak if normalize == 'each' else 1./max(peaks) for peak in peaks]
+
+        # One audio file holding every trace (one sprite each), separated by a little silence
+        sprites = {}
+        channels = []
+        blocks = []
+        time_steps_list = []
+        true_scales = []  # true seconds per sonified second
+        offset = 0
+        gap_len = int(round(gap*fs_resamp))
+        for i, (data, fs_i, scale) in enumerate(zip(data_list, fs_list, scales)):
+            resampler_i = resampling.Resampler(len(data)/float(TargetDuration), fs_resamp, method=resampler,
+                                               quality=resample_quality)
+            n_out = resampler_i.backend.n_out(len(data))
+            channel = 'ch%d' % i
+            sprites[channel] = [1000.*offset/fs_resamp, 1000.*n_out/fs_resamp]
+            channels.append(channel)
+            if stream:
+                blocks.append(resampler_i.blocks(data, block_len, scale=scale))
+            else:
+                blocks.append([resampler_i.resample(data)*scale])
+            blocks.append([np.zeros(gap_len)])
+            offset += n_out + gap_len
+            time_steps_list.append(np.arange(len(data))/resampler_i.fs_in)
+            true_scales.append(resampler_i.fs_in/fs_i)
+        blocks = itertools.chain.from_iterable(blocks)
+        if audio_file is not None:
+            audio_source = _sidecar_source(blocks, fs_resamp, audio_file, audio_url=audio_url)
+        else:
+            audio_source = _wav_source(blocks, fs_resamp)
+
+        # Bokeh Player setup
+        duration = min(sprite[1] for sprite in sprites.values())/1000.
+        player = BokehAudioPlayer.MultiAudioPlayerModel(
+            audio_source=audio_source, sprites=sprites, channels=channels,
+            channel_select=bkm.widgets.CheckboxButtonGroup(labels=list(titles), active=list(active), width=150, sizing_mode='scale_width'),
+            default_title=bkm.widgets.TextInput(value=default_title, title="", width=150, sizing_mode='scale_width'),
+            play_pause_button=bkm.widgets.Toggle(label="Play", width=100, button_type="success"),
+            stop_button=bkm.widgets.Button(label="Stop", width=100, button_type="success"),
+            download_button=bkm.widgets.Button(label="Save", width=100, button_type="success"),
+            seek_bar=bkm.widgets.Slider(start=0, end=duration, step=TargetDuration/80., value=0, title="Time [s]", width=150, sizing_mode='scale_width'),
+            volume_bar=bkm.widgets.Slider(start=0, end=1, step=0.01, value=1, title="Volume", width=150, sizing_mode='scale_width'),
+            sizing_mode="fixed")
+        player.children = [player.default_title, player.channel_select, player.volume_bar, player.seek_bar,
+                           player.play_pause_button, player.stop_button, player.download_button]
+
+        # One plot per trace, sharing the sonified time axis and each with its own seek bar span
+        # and true time axis
+        plots = []
+        spans = []
+        true_ranges = []
+        for data_dis, time_steps, true_scale, plot_title in zip(data_dis_list, time_steps_list, true_scales, titles):
+            plot = figure(plot_width=plot_width, plot_height=plot_height, sizing_mode='scale_width',
+                          x_range=plots[0].x_range if plots else (0, time_steps[-1]),
+                          title=plot_title, x_axis_label=x_axis_label, y_axis_label=y_axis_label,
+                          tools=tools)
+            plot.line(time_steps, np.asarray(data_dis))
+            true_range = bkm.Range1d(start=0, end=time_steps[-1]*true_scale/3600, tags=[true_scale/3600])
+            plot.extra_x_ranges = {"true_time": true_range}
+            plot.add_layout(bkm.LinearAxis(x_range_name="true_time", axis_label=x_axis_label_true), 'below')
+            span = bkm.Span(dimension="height", line_color=seek_bar_color,
+                            line_width=seek_bar_width, line_alpha=seek_bar_alpha,
+                            tags=[time_series_start])
+            plot.add_layout(span)
+            plots.append(plot)
+            spans.append(span)
+            true_ranges.append(true_range)
+        # Keep the true time axes in step with the shared sonified one on zoom and pan
+        true_time_callback = bkm.CustomJS(args=dict(xr=plots[0].x_range, true_ranges=true_ranges), code="""
+            for (var i = 0; i < true_ranges.length; i++) {
+                true_ranges[i].setv({start: xr.start*true_ranges[i].tags[0], end: xr.end*true_ranges[i].tags[0]});
+            }
+        """)
+        plots[0].x_range.js_on_change('start', true_time_callback)
+        plots[0].x_range.js_on_change('end', true_time_callback)
+
+        # A single callback moves every span when the seek bar moves
+        player.seek_bar.js_on_change('value', bkm.CustomJS(args=dict(spans=spans), code="""
+            for (var i = 0; i < spans.length; i++) {
+                spans[i].location = cb_obj.value == 0 ? null : cb_obj.value + spans[i].tags[0];
+            }
+        """))
+        player.seek_bar.callback_throttle = seek_bar_throttle
+
+        grid = layout([[column(plots, sizing_mode='scale_width'), player]])
+        grid.sizing_mode = 'scale_width'
+
+        return grid
+
+
+class StreamingAudioPlayerModel(bkm.layouts.WidgetBox):
+    """
+    Audio player for a live stream, using the Web Audio API. The server pushes chunks of
+    float32 samples (push_audio) and the browser plays each one right after the previous, a
+    little ahead of time. Chunks that arrive too late restart the schedule min_latency ahead,
+    and chunks that would play more than max_latency ahead are dropped, so the delay between
+    data and sound stays bounded however long the stream runs.
+
+    """
+
+    __implementation__ = """
+    import * as p from "core/properties"
+    import {WidgetBox, WidgetBoxView} from "models/layouts/widget_box"
+
+    export class StreamingAudioPlayerView extends WidgetBoxView
+
+        initialize: (options) ->
+            super(options)
+            @ctx = null  # created on the first click: browsers only allow audio after a user gesture
+            @next_time = 0  # audio context time where the next chunk starts
+            @connect(@model.properties.chunk_index.change, @play_chunk)
+            @connect(@model.play_pause_button.properties.active.change, @play_pause_press)
+            @connect(@model.volume_bar.properties.value.change, () => @gain.gain.value = @model.volume_bar.value if @ctx?)
+
+        play_pause_press: () =>
+            if @model.play_pause_button.active
+                if not @ctx?
+                    @ctx = new (window.AudioContext or window.webkitAudioContext)()
+                    @gain = @ctx.createGain()
+                    @gain.gain.value = @model.volume_bar.value
+                    @gain.connect(@ctx.destination)
+                @ctx.resume()
+                @model.play_pause_button.label = "Mute"
+            else
+                @ctx.suspend() if @ctx?
+                @model.play_pause_button.label = "Listen"
+
+        play_chunk: () =>
+            return if not @ctx? or not @model.play_pause_button.active or not @model.chunk
+            bytes = atob(@model.chunk)
+            samples = new Float32Array(bytes.length/4)
+            view = new DataView(samples.buffer)
+            for i in [0...bytes.length]
+                view.setUint8(i, bytes.charCodeAt(i))
+            buffer = @ctx.createBuffer(1, samples.length, @model.sample_rate)
+            buffer.getChannelData(0).set(samples)
+            now = @ctx.currentTime
+            if @next_time < now + @model.min_latency/2
+                @next_time = now + @model.min_latency  # underrun: start over a little ahead
+            return if @next_time > now + @model.max_latency  # too far behind: drop to catch up
+            source = @ctx.createBufferSource()
+            source.buffer = buffer
+            source.connect(@gain)
+            source.start(@next_time)
+            @next_time += buffer.duration
+
+    export class StreamingAudioPlayerModel extends WidgetBox
+        default_view: StreamingAudioPlayerView
+        type: "StreamingAudioPlayerModel"
+
+        @define {
+            chunk:              [p.String, '']
+            chunk_index:        [p.Number, 0]
+            sample_rate:        [p.Number, 44100]
+            min_latency:        [p.Number, 0.3]
+            max_latency:        [p.Number, 2.0]
+            play_pause_button:  [p.Any, ]
+            volume_bar:         [p.Any, ]
+        }
+
+    """
+
+    chunk = bkc.properties.String(default='', help="Latest audio chunk: base64 encoded little-endian float32 samples.")
+    chunk_index = bkc.properties.Int(default=0, help="Incremented with every chunk, which triggers its playback.")
+    sample_rate = bkc.properties.Float(default=44100, help="Sample rate of the chunks (Hz).")
+    min_latency = bkc.properties.Float(default=0.3, help="Seconds a chunk is scheduled ahead after an underrun.")
+    max_latency = bkc.properties.Float(default=2.0, help="Chunks that would start more than this many seconds ahead are dropped.")
+    play_pause_button = bkc.properties.Instance(bkm.widgets.Toggle, help="Toggle switching the sound on and off.")
+    volume_bar = bkc.properties.Instance(bkm.widgets.Slider, help="Volume bar to control playback gain.")
+
+    def push_audio(self, samples):
+        """
+        Send samples (floats in -1..1 at sample_rate) to the browser, to play after the previous chunk.
+
+        """
+        import base64
+        import numpy as np
+
+        if len(samples) == 0:
+            return
+        self.chunk = base64.b64encode(np.asarray(samples, dtype='<f4').tobytes()).decode('ascii')
+        self.chunk_index += 1
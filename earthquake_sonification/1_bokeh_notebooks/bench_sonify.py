@@ -0,0 +1,211 @@
+# encoding: utf-8
+# Benchmarks for the sonification pipeline of EI LIVE 2020:
+# Time sonify_plotwf / sonify_plotwfspec (profile=True, so every stage is reported with its wall time
+# and peak memory) on synthetic traces of 10^4 to 10^8 samples and on the bundled traces in ../data,
+# and compare throughput and page size against a previous run to catch regressions.
+#
+#     python bench_sonify.py --out bench.json                       # default sizes 1e4 to 1e7
+#     python bench_sonify.py --sizes 1e8 --modes file               # long records, streamed to files
+#     python bench_sonify.py --out new.json --baseline bench.json   # exit status 1 on a regression
+#
+# Modes: 'embed' is the default behaviour (audio embedded as base64, full waveform and spectrogram in
+# the page) and 'file' streams the audio to a wav file next to the page, with the waveform and
+# spectrogram drawn at zoom-dependent resolution (stream, audio_file, lod_points, spec_tile_size).
+#
+import os
+import time
+
+
+MODES = {
+    'embed': {},
+    'file': dict(stream=True, lod_points=4000, spec_tile_size=256),
+}
+
+
+def synthetic_trace(npts, fs=40., seed=0, path=None, block_len=2**22):
+    """
+    Reproducible synthetic seismogram of npts samples: background noise plus a decaying
+    wave packet at a third of the record. With path set, it is written block by block to a
+    .npy file and returned memory-mapped, so records larger than memory can be benchmarked.
+
+    """
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+    if path is None:
+        data = np.empty(npts)
+    else:
+        data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(npts,))
+    t_arrival = npts/fs/3
+    for i0 in range(0, npts, block_len):
+        t = np.arange(i0, min(i0+block_len, npts))/fs
+        packet = np.where(t > t_arrival, np.exp(-(t-t_arrival)/(npts/fs/10)), 0.)*np.sin(2*np.pi*0.05*t)
+        data[i0:i0+len(t)] = 0.1*rng.standard_normal(len(t)) + packet
+    if path is not None:
+        data.flush()
+    return data
+
+
+def _dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, fname))
+               for root, dirs, fnames in os.walk(path) for fname in fnames)
+
+
+def run_case(name, data, fs, outdir, function='sonify_plotwfspec', mode='embed', repeat=1,
+             TargetDuration=30, **options):
+    """
+    Sonify data repeat times with profile=True and return the fastest run: total seconds,
+    samples per second, html and audio bytes, the largest stage peak memory and all stages.
+
+    """
+    import shutil
+    import BokehAudioPlayer
+
+    func = getattr(BokehAudioPlayer.AudioPlayerModel, function)
+    opts = dict(MODES[mode], **options)
+    case_dir = os.path.join(outdir, '%s_%s_%s' % (name, function, mode))
+    best = None
+    for irun in range(repeat):
+        shutil.rmtree(case_dir, ignore_errors=True)
+        os.makedirs(case_dir)
+        if mode == 'file':
+            opts.update(audio_file=os.path.join(case_dir, 'audio.wav'), audio_url='audio.wav')
+        t0 = time.perf_counter()
+        grid, stages = func(data, fs, data, TargetDuration, name, name, profile=True, **opts)
+        seconds = time.perf_counter() - t0
+        if best is None or seconds < best['seconds']:
+            best = dict(case='%s/%s/%s' % (name, function, mode), npts=len(data), seconds=seconds,
+                        samples_per_s=len(data)/seconds,
+                        html_bytes=[s for s in stages if s['stage'] == 'serialize'][0]['bytes'],
+                        audio_bytes=_dir_bytes(case_dir),
+                        peak_bytes=max(s['peak_bytes'] for s in stages), stages=stages)
+    shutil.rmtree(case_dir, ignore_errors=True)
+    return best
+
+
+def run_benchmarks(outdir, sizes=(10**4, 10**5, 10**6, 10**7), datadir='../data', functions=('sonify_plotwfspec',),
+                   modes=('embed', 'file'), repeat=1, max_embed=10**6, memmap_above=10**7,
+                   resampler='auto', resample_quality='medium', verbose=True):
+    """
+    Run every function and mode on synthetic traces of the given sizes and on the csv traces
+    in datadir (None to skip them). 'embed' mode is skipped above max_embed samples, where the
+    page would hold the full waveform, and synthetic traces above memmap_above samples are
+    memory-mapped from outdir. resampler and resample_quality are passed to every case.
+    Returns a dict with the environment and one result per case.
+
+    """
+    import platform
+    import numpy as np
+    import scipy
+    import bokeh
+    import resampling
+    import sonify_batch
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    options = dict(resampler=resampler, resample_quality=resample_quality)
+    # Warm up the resampling backend being timed (imports, and numba compilation for resampy)
+    run_case('warmup', synthetic_trace(10**4), 40., outdir, **options)
+
+    traces = [('synthetic_%.0e' % npts, npts, None) for npts in sizes]
+    if datadir is not None:
+        traces += [(os.path.splitext(fname)[0], None, os.path.join(datadir, fname))
+                   for fname in sorted(os.listdir(datadir)) if fname.endswith('.csv')]
+    results = []
+    for name, npts, path in traces:
+        if path is None:
+            fs = 40.
+            mmap_path = os.path.join(outdir, name + '.npy') if npts > memmap_above else None
+            data = synthetic_trace(int(npts), fs, path=mmap_path)
+        else:
+            data, fs = sonify_batch.load_trace(path)
+        for function in functions:
+            for mode in modes:
+                if mode == 'embed' and len(data) > max_embed:
+                    continue
+                result = run_case(name, data, fs, outdir, function=function, mode=mode, repeat=repeat, **options)
+                results.append(result)
+                if verbose:
+                    print_result(result)
+        del data
+        if path is None and npts > memmap_above:
+            os.remove(os.path.join(outdir, name + '.npy'))
+
+    method = resampling.Resampler(40., 44100, method=resampler, quality=resample_quality).method
+    environment = dict(python=platform.python_version(), machine=platform.machine(), numpy=np.__version__,
+                       scipy=scipy.__version__, bokeh=bokeh.__version__, resampler=method,
+                       resample_quality=resample_quality)
+    if method == 'resampy':
+        import resampy
+        environment['resampy'] = resampy.__version__
+    return dict(environment=environment, results=results)
+
+
+def print_result(r):
+    stages = '  '.join('%s %.2fs' % (s['stage'], s['seconds']) for s in r['stages'])
+    print('%-45s %10d  %8.2fs  %10.0f samples/s  html %9d B  audio %9d B  peak %6.0f MB  | %s' %
+          (r['case'], r['npts'], r['seconds'], r['samples_per_s'], r['html_bytes'], r['audio_bytes'],
+           r['peak_bytes']/2.**20, stages))
+
+
+def compare(results, baseline, time_tol=0.25, size_tol=0.05):
+    """
+    Cases in results (see run_benchmarks) that are slower than in baseline by more than time_tol,
+    or whose html page grew by more than size_tol (fractions). Returns a list of messages.
+
+    """
+    old = {r['case']: r for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        b = old.get(r['case'])
+        if b is None:
+            continue
+        if r['seconds'] > b['seconds']*(1+time_tol):
+            regressions.append('%s: %.2fs, was %.2fs' % (r['case'], r['seconds'], b['seconds']))
+        if r['html_bytes'] > b['html_bytes']*(1+size_tol):
+            regressions.append('%s: html %d B, was %d B' % (r['case'], r['html_bytes'], b['html_bytes']))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import shutil
+    import sys
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Benchmark the sonification pipeline.')
+    parser.add_argument('--sizes', type=float, nargs='*', default=[1e4, 1e5, 1e6, 1e7],
+                        help='synthetic trace lengths (samples)')
+    parser.add_argument('--data', default='../data', help="directory of bundled csv traces ('' to skip)")
+    parser.add_argument('--functions', nargs='+', default=['sonify_plotwfspec'],
+                        choices=['sonify_plotwf', 'sonify_plotwfspec'])
+    parser.add_argument('--modes', nargs='+', default=['embed', 'file'], choices=sorted(MODES))
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case (the fastest is kept)')
+    parser.add_argument('--resampler', default='auto', choices=['auto', 'poly', 'resampy'])
+    parser.add_argument('--resample_quality', default='medium', choices=['fast', 'medium', 'best'])
+    parser.add_argument('--max_embed', type=float, default=1e6, help="largest trace run in 'embed' mode")
+    parser.add_argument('--workdir', default=None, help='scratch directory (temporary if not given)')
+    parser.add_argument('--out', default=None, help='save results to this json file')
+    parser.add_argument('--baseline', default=None, help='json file of an earlier run to compare against')
+    parser.add_argument('--time_tol', type=float, default=0.25)
+    parser.add_argument('--size_tol', type=float, default=0.05)
+    args = parser.parse_args()
+
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix='bench_sonify_')
+    results = run_benchmarks(workdir, sizes=[int(n) for n in args.sizes], datadir=args.data or None,
+                             functions=args.functions, modes=args.modes, repeat=args.repeat,
+                             max_embed=int(args.max_embed), resampler=args.resampler,
+                             resample_quality=args.resample_quality)
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), time_tol=args.time_tol, size_tol=args.size_tol)
+        for message in regressions:
+            print('REGRESSION ' + message)
+        if regressions:
+            sys.exit(1)
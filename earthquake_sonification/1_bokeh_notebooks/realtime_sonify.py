@@ -0,0 +1,405 @@
+# encoding: utf-8
+# Real-time sonification for EI LIVE 2020:
+# BokehAudioPlayer sonifies a finished record. Here packets arrive one by one, from a live
+# SeedLink server or from a file replayed at speed times real time as a stand-in, and every
+# packet is band-pass filtered, sped up and resampled with state carried from the previous
+# packet (scipy.signal.sosfilt and resampling.Resampler.process). The audio is pushed to the
+# browser (BokehAudioPlayer.StreamingAudioPlayerModel, Web Audio), the waveform envelope is
+# extended with ColumnDataSource.stream and the spectrogram grows by a few columns at a time.
+# Sources drop packets they cannot deliver in time, the plots roll over after window seconds
+# and the filter, resampler and spectrogram only keep their overlap with the next packet, so
+# latency and memory stay constant however long the stream runs.
+#
+#     python realtime_sonify.py ../data/MAJO_M9.1_BHZ.csv --speed 500 --freqmin 0.005 --window 7200
+#     python realtime_sonify.py seedlink://rtserve.iris.washington.edu:18000/IU.ANMO.00.BHZ --freqmin 0.5
+#
+# and open http://localhost:5006/. From python:
+#
+#     import realtime_sonify
+#     realtime_sonify.serve(lambda: realtime_sonify.FileReplaySource('../data/MAJO_M9.1_BHZ.csv', speed=500),
+#                           speed=500, freqmin=0.005, window=7200)
+#
+import collections
+import time
+
+
+class FileReplaySource(object):
+    """
+    Replay a trace file (csv or trace_io .npy, see sonify_batch.load_trace) as a live stream:
+    poll() returns the packets of packet_len samples that a server sending the data at speed
+    times real time would have delivered since the last call. After a stall, packets more than
+    max_delay seconds (wall time) late are skipped instead of being delivered in a burst.
+    With loop=True the file starts over at its end, in the middle of a packet if need be, so the
+    stream carries on without a gap.
+
+    """
+    def __init__(self, path, speed=1., packet_len=512, max_delay=2., loop=False):
+        import sonify_batch
+
+        self.data, self.fs = sonify_batch.load_trace(path)
+        self.speed = float(speed)
+        self.packet_len = packet_len
+        self.max_delay = max_delay
+        self.loop = loop
+        self.next = 0  # first sample not yet delivered
+        self.t_start = None
+
+    def poll(self):
+        """
+        Packets due by now, as a list of (start time in seconds since the start of the stream, samples).
+
+        """
+        import numpy as np
+
+        now = time.monotonic()
+        if self.t_start is None:
+            self.t_start = now
+        due = int((now - self.t_start)*self.speed*self.fs)//self.packet_len*self.packet_len
+        late = int(self.max_delay*self.speed*self.fs)//self.packet_len*self.packet_len
+        if due - self.next > late:
+            self.next = due - late  # skip what is too old to be useful
+        n = len(self.data)
+        packets = []
+        while self.next + self.packet_len <= due:
+            i0 = self.next % n if self.loop else self.next
+            if i0 >= n:
+                break
+            packet = np.asarray(self.data[i0:i0+self.packet_len], dtype=np.float64)
+            if self.loop and len(packet) < self.packet_len:
+                # stitch the end of the file to its start, so the wrap is not a gap in the stream
+                rest = np.asarray(self.data[:self.packet_len-len(packet)], dtype=np.float64)
+                packet = np.concatenate([packet, rest])
+            packets.append((self.next/self.fs, packet))
+            self.next += len(packet)
+        return packets
+
+    def close(self):
+        pass
+
+
+class SeedLinkSource(object):
+    """
+    Live packets of one channel from a SeedLink server (obspy's EasySeedLinkClient, in a
+    background thread). At most max_packets packets are kept waiting; older ones are dropped
+    if nothing polls them in time.
+
+    """
+    def __init__(self, server, network, station, location, channel, max_packets=64):
+        import threading
+        from obspy.clients.seedlink.easyseedlink import create_client
+
+        self.packets = collections.deque(maxlen=max_packets)
+        self.fs = None
+        self.t0 = None
+        self.lock = threading.Lock()
+        self.client = create_client(server, on_data=self._on_data)
+        self.client.select_stream(network, station, '%s%s' % (location, channel) if location else channel)
+        self.thread = threading.Thread(target=self.client.run, daemon=True)
+        self.thread.start()
+
+    def _on_data(self, trace):
+        with self.lock:
+            if self.t0 is None:
+                self.t0, self.fs = trace.stats.starttime, trace.stats.sampling_rate
+            self.packets.append((trace.stats.starttime - self.t0, trace.data.astype(float)))
+
+    def wait_for_rate(self, timeout=60.):
+        """
+        Block until the first packet gives the sample rate, which the processing needs.
+
+        """
+        t_end = time.monotonic() + timeout
+        while self.fs is None:
+            if time.monotonic() > t_end:
+                raise RuntimeError("no data from the SeedLink server after %g s" % timeout)
+            time.sleep(0.1)
+        return self.fs
+
+    def poll(self):
+        with self.lock:
+            packets = list(self.packets)
+            self.packets.clear()
+        return packets
+
+    def close(self):
+        self.client.close()
+
+
+def open_source(spec, speed=1., **options):
+    """
+    Source for spec: 'seedlink://host:port/NET.STA.LOC.CHA' or the path of a trace file,
+    replayed at speed times real time.
+
+    """
+    if spec.startswith('seedlink://'):
+        server, stream = spec[len('seedlink://'):].split('/', 1)
+        network, station, location, channel = stream.split('.')
+        source = SeedLinkSource(server, network, station, location, channel, **options)
+        source.wait_for_rate()
+        return source
+    return FileReplaySource(spec, speed=speed, **options)
+
+
+class RollingSpectrogram(object):
+    """
+    Spectrogram of a stream (scipy.signal.spectrogram frames of nperseg samples, hop of
+    nperseg-noverlap): process() returns the frames completed by each chunk and keeps only
+    the samples the next frame still needs.
+
+    """
+    def __init__(self, fs, nperseg=128, noverlap=None):
+        import numpy as np
+
+        self.fs = fs
+        self.nperseg = nperseg
+        self.noverlap = nperseg//2 if noverlap is None else noverlap
+        self.hop = self.nperseg - self.noverlap
+        self.f = np.fft.rfftfreq(nperseg, 1./fs)
+        self.reset()
+
+    def reset(self, t0=0.):
+        import numpy as np
+
+        self._buf = np.zeros(0)
+        self._t0 = t0  # time of self._buf[0]
+
+    def process(self, chunk):
+        """
+        Times (frame centres) and power in dB (one column per frame) of the frames completed by chunk.
+
+        """
+        import numpy as np
+        from scipy import signal
+
+        self._buf = np.concatenate([self._buf, chunk])
+        n_frames = (len(self._buf) - self.nperseg)//self.hop + 1 if len(self._buf) >= self.nperseg else 0
+        if n_frames == 0:
+            return np.zeros(0), np.zeros((len(self.f), 0))
+        used = (n_frames-1)*self.hop + self.nperseg
+        f, t, Sxx = signal.spectrogram(self._buf[:used], self.fs, nperseg=self.nperseg, noverlap=self.noverlap)
+        t = t + self._t0
+        self._buf = self._buf[n_frames*self.hop:]
+        self._t0 += n_frames*self.hop/self.fs
+        return t, 10*np.log10(np.maximum(Sxx, 1e-30))
+
+
+class StreamProcessor(object):
+    """
+    Turn packets of a stream sampled at fs into audio at fs_audio, played speed times faster
+    than real time, plus a min/max envelope of plot_decim samples per point and spectrogram
+    columns of the band-passed data. The filter (Butterworth, corners poles, freqmin and/or
+    freqmax in Hz), the resampler and the spectrogram carry their state between packets; a
+    gap in the packet times resets them. The audio is normalized by a peak that decays over
+    agc_seconds of data, as the global peak of a live stream is never known.
+
+    """
+    def __init__(self, fs, speed, freqmin=None, freqmax=None, corners=4, fs_audio=44100,
+                 resample_quality='fast', plot_decim=1, nperseg=128, noverlap=None, agc_seconds=600.):
+        from scipy import signal
+        import resampling
+
+        self.fs = fs
+        self.resampler = resampling.Resampler(fs*speed, fs_audio, quality=resample_quality)
+        self.speed = self.resampler.fs_in/fs  # exact speed-up implied by the resampling ratio
+        if abs(self.speed/speed - 1) > 1e-3:
+            raise ValueError("resampling %g Hz to %g Hz plays %g times faster instead of %g"
+                             % (fs*speed, fs_audio, self.speed, speed))
+        if freqmin and freqmax:
+            self.sos = signal.butter(corners, [freqmin, freqmax], 'bandpass', fs=fs, output='sos')
+        elif freqmin:
+            self.sos = signal.butter(corners, freqmin, 'highpass', fs=fs, output='sos')
+        elif freqmax:
+            self.sos = signal.butter(corners, freqmax, 'lowpass', fs=fs, output='sos')
+        else:
+            self.sos = None
+        self.plot_decim = max(int(plot_decim), 1)
+        self.spectrogram = RollingSpectrogram(fs, nperseg, noverlap)
+        self.agc_seconds = agc_seconds
+        self.peak = 0.
+        self.t_next = None  # expected start time of the next packet
+        self.reset()
+
+    def reset(self, t0=0.):
+        import numpy as np
+
+        self.zi = None
+        self.resampler.reset()
+        self.spectrogram.reset(t0)
+        self._env = np.zeros(0)  # samples not yet in an envelope point
+        self._env_t0 = t0
+
+    def _envelope(self, y):
+        import numpy as np
+
+        self._env = np.concatenate([self._env, y])
+        n = len(self._env)//self.plot_decim*self.plot_decim
+        bins = self._env[:n].reshape(-1, self.plot_decim)
+        t = self._env_t0 + (np.arange(len(bins)) + 0.5)*self.plot_decim/self.fs
+        self._env = self._env[n:]
+        self._env_t0 += n/self.fs
+        # min and max of every bin, in turn, so a line through them fills the envelope
+        return np.repeat(t, 2), np.column_stack([bins.min(axis=1), bins.max(axis=1)]).ravel()
+
+    def process(self, t0, packet):
+        """
+        Process the packet starting at t0 (seconds). Returns a dict with 'audio' (float samples in -1..1
+        at fs_audio), 'wave_t'/'wave' (envelope) and 'spec_t'/'spec_db' (new spectrogram columns).
+
+        """
+        import numpy as np
+        from scipy import signal
+
+        audio = []
+        if self.t_next is not None and abs(t0 - self.t_next) > 1.5/self.fs:
+            audio.append(self.resampler.process(np.zeros(0), final=True))  # flush the audio before the gap
+            self.reset(t0)
+        elif self.t_next is None:
+            self.reset(t0)
+        self.t_next = t0 + len(packet)/self.fs
+
+        y = np.asarray(packet, dtype=np.float64)
+        if self.sos is not None:
+            if self.zi is None:
+                self.zi = signal.sosfilt_zi(self.sos)*y[0]  # start in steady state, without a step
+            y, self.zi = signal.sosfilt(self.sos, y, zi=self.zi)
+        audio.append(self.resampler.process(y))
+        audio = np.concatenate(audio)
+        self.peak = max(self.peak*np.exp(-len(y)/self.fs/self.agc_seconds), np.abs(y).max() if len(y) else 0.)
+        if self.peak > 0:
+            audio = np.clip(audio*(0.9/self.peak), -1., 1.)
+        wave_t, wave = self._envelope(y)
+        spec_t, spec_db = self.spectrogram.process(y)
+        return dict(audio=audio, wave_t=wave_t, wave=wave, spec_t=spec_t, spec_db=spec_db)
+
+
+def realtime_app(make_source, speed=1., freqmin=None, freqmax=None, corners=4, window=600., period_ms=100,
+                 fs_audio=44100, resample_quality='fast', plot_points=4000, nperseg=128, noverlap=None,
+                 spec_blocks=50, dynamic_range=60., plot_width=900, plot_height=300, palette='Viridis256',
+                 min_latency=0.3, max_latency=2.0, title="Live seismogram"):
+    """
+    Bokeh server application (a function of the document) sonifying the stream of
+    make_source() (called once per browser session, e.g. lambda: FileReplaySource(path, speed))
+    and plotting its last window seconds: every period_ms the packets that arrived are processed
+    (StreamProcessor) and the audio pushed to the player. The waveform keeps about plot_points
+    envelope points and the spectrogram spec_blocks images of columns, dynamic_range dB deep.
+
+    """
+    def modify_doc(doc):
+        import numpy as np
+        import bokeh.models as bkm
+        from bokeh.plotting import figure
+        from bokeh.layouts import layout
+        import BokehAudioPlayer
+
+        source = make_source()
+        fs = source.fs
+        plot_decim = max(int(window*fs/(plot_points/2)), 1)
+        processor = StreamProcessor(fs, speed, freqmin=freqmin, freqmax=freqmax, corners=corners,
+                                    fs_audio=fs_audio, resample_quality=resample_quality, plot_decim=plot_decim,
+                                    nperseg=nperseg, noverlap=noverlap)
+        spectrogram = processor.spectrogram
+        frames_in_window = int(window*fs/spectrogram.hop) + 1
+        spec_block = max(frames_in_window//spec_blocks, 1)
+
+        player = BokehAudioPlayer.StreamingAudioPlayerModel(
+            sample_rate=fs_audio, min_latency=min_latency, max_latency=max_latency,
+            play_pause_button=bkm.widgets.Toggle(label="Listen", width=100, button_type="success"),
+            volume_bar=bkm.widgets.Slider(start=0, end=1, step=0.01, value=1, title="Volume", width=150),
+            sizing_mode="fixed")
+        player.children = [player.volume_bar, player.play_pause_button]
+        stats = bkm.Div(text="", width=250)
+
+        # Both plots follow the end of the stream, window seconds wide
+        x_range = bkm.DataRange1d(follow='end', follow_interval=window, range_padding=0)
+        wave_source = bkm.ColumnDataSource(data=dict(t=[], y=[]))
+        wave_plot = figure(plot_width=plot_width, plot_height=plot_height, x_range=x_range, title=title,
+                           y_axis_label='Counts (filtered)', tools='xpan,xwheel_zoom,reset,save,crosshair')
+        wave_plot.line('t', 'y', source=wave_source)
+        spec_source = bkm.ColumnDataSource(data=dict(image=[], x=[], dw=[]))
+        mapper = bkm.LinearColorMapper(palette=palette, low=-dynamic_range, high=0)
+        spec_plot = figure(plot_width=plot_width, plot_height=plot_height, x_range=x_range,
+                           y_range=(spectrogram.f[0], spectrogram.f[-1]), x_axis_label='Time (s)',
+                           y_axis_label='Frequency (Hz)', tools='xpan,xwheel_zoom,reset,save,crosshair')
+        spec_plot.image(image='image', x='x', y=spectrogram.f[0], dw='dw', dh=spectrogram.f[-1]-spectrogram.f[0],
+                        source=spec_source, color_mapper=mapper)
+        spec_plot.add_layout(bkm.ColorBar(color_mapper=mapper, location=(0, 0), width=15, title="dB"), 'right')
+
+        pending = dict(t=[], db=[])  # spectrogram columns not yet sent
+        status = dict(samples=0, audio_s=0., seconds=0., ticks=0, peak_db=None)
+
+        def tick():
+            t_start = time.perf_counter()
+            for t0, packet in source.poll():
+                out = processor.process(t0, packet)
+                player.push_audio(out['audio'])
+                status['samples'] += len(packet)
+                status['audio_s'] += len(out['audio'])/float(fs_audio)
+                if len(out['wave']):
+                    # rollover keeps the last plot_points points in the browser and on the server
+                    wave_source.stream(dict(t=out['wave_t'], y=out['wave']), rollover=plot_points)
+                if len(out['spec_t']):
+                    pending['t'].append(out['spec_t'])
+                    pending['db'].append(out['spec_db'])
+            if pending['t'] and sum(len(t) for t in pending['t']) >= spec_block:
+                t = np.concatenate(pending['t'])
+                db = np.hstack(pending['db'])
+                peak_db = db.max()
+                # colour scale follows the loudest column, decaying so quiet spells become visible
+                status['peak_db'] = peak_db if status['peak_db'] is None else max(peak_db, status['peak_db'] - 1.)
+                mapper.update(low=status['peak_db'] - dynamic_range, high=status['peak_db'])
+                spec_source.stream(dict(image=[db.astype(np.float32)], x=[t[0] - spectrogram.hop/fs/2.],
+                                        dw=[len(t)*spectrogram.hop/fs]), rollover=spec_blocks+1)
+                pending['t'], pending['db'] = [], []
+            status['seconds'] += time.perf_counter() - t_start
+            status['ticks'] += 1
+            if status['ticks'] % 10 == 0:
+                stats.text = ("%d samples, %.1f s of audio<br>processing %.1f ms per tick (every %d ms)"
+                              % (status['samples'], status['audio_s'], 1e3*status['seconds']/status['ticks'],
+                                 period_ms))
+
+        doc.add_periodic_callback(tick, period_ms)
+        doc.on_session_destroyed(lambda session_context: source.close())
+        doc.add_root(layout([[wave_plot, [player, stats]], [spec_plot]]))
+        doc.title = title
+
+    return modify_doc
+
+
+def serve(make_source, port=5006, show=False, **app_options):
+    """
+    Run realtime_app on a Bokeh server at http://localhost:port/.
+
+    """
+    from bokeh.application import Application
+    from bokeh.application.handlers import FunctionHandler
+    from bokeh.server.server import Server
+
+    server = Server({'/': Application(FunctionHandler(realtime_app(make_source, **app_options)))}, port=port)
+    server.start()
+    if show:
+        server.io_loop.add_callback(server.show, '/')
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sonify a live (or replayed) seismic stream in the browser.')
+    parser.add_argument('source', help='trace file to replay (csv or .npy) or seedlink://host:port/NET.STA.LOC.CHA')
+    parser.add_argument('--speed', type=float, default=1., help='playback speed-up (and replay speed of a file)')
+    parser.add_argument('--freqmin', type=float, default=None, help='band-pass corner (Hz)')
+    parser.add_argument('--freqmax', type=float, default=None, help='band-pass corner (Hz)')
+    parser.add_argument('--window', type=float, default=600., help='seconds of data shown')
+    parser.add_argument('--packet_len', type=int, default=512, help='samples per replayed packet')
+    parser.add_argument('--loop', action='store_true', help='replay the file over and over')
+    parser.add_argument('--resample_quality', default='fast', choices=['fast', 'medium', 'best'])
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--show', action='store_true', help='open a browser tab')
+    args = parser.parse_args()
+
+    if args.source.startswith('seedlink://'):
+        make_source = lambda: open_source(args.source)
+    else:
+        make_source = lambda: open_source(args.source, speed=args.speed, packet_len=args.packet_len, loop=args.loop)
+    serve(make_source, port=args.port, show=args.show, speed=args.speed, freqmin=args.freqmin, freqmax=args.freqmax,
+          window=args.window, resample_quality=args.resample_quality)
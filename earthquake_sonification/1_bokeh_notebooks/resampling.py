@@ -0,0 +1,264 @@
+# encoding: utf-8
+# Resampling for the sonification of EI LIVE 2020:
+# A trace is played back at fs_sound (the sample rate that squeezes the record into TargetDuration
+# seconds) and has to be resampled to an audio rate such as 44100 Hz. The ratio is approximated by a
+# fraction up/down and the trace filtered with a polyphase FIR (scipy.signal.resample_poly), which
+# costs about the same per input sample whatever the speed-up, or with resampy's band-limited
+# interpolation. Long records are resampled block by block, with the blocks aligned on whole
+# output samples so that the result matches resampling the whole trace at once.
+#
+#     r = resampling.Resampler(fs_sound, 44100, quality='medium')
+#     r.fs_in                                       # exact playback rate implied by up/down
+#     audio = r.resample(data)                      # whole trace
+#     for block in r.blocks(data): ...              # blocks of e.g. a memory-mapped trace
+#     out = r.process(chunk)                        # live stream, state carried between chunks
+#     out = r.process(last_chunk, final=True)
+#
+from fractions import Fraction
+
+
+class PolyphaseBackend(object):
+    """
+    Polyphase FIR (scipy.signal.resample_poly) with a Kaiser-windowed sinc filter spanning
+    zero_crossings zero crossings of the lower of the two sample rates on either side.
+
+    """
+    def __init__(self, up, down, zero_crossings=10, beta=5.0):
+        import numpy as np
+        from scipy import signal
+
+        self.up, self.down = up, down
+        max_rate = max(up, down)
+        half_len = zero_crossings*max_rate if max_rate > 1 else 0
+        if half_len:
+            self.h = signal.firwin(2*half_len+1, 1./max_rate, window=('kaiser', beta))
+        else:
+            self.h = np.ones(1)  # same rate: nothing to filter
+        # input samples the filter reaches on either side of an output sample
+        self.pad = int(np.ceil(half_len/float(up))) + 1
+
+    def __call__(self, x):
+        from scipy import signal
+
+        return signal.resample_poly(x, self.up, self.down, window=self.h)
+
+    def n_out(self, n):
+        return -(-n*self.up//self.down)
+
+
+class ResampyBackend(object):
+    """
+    Band-limited sinc interpolation with resampy (filter 'kaiser_best' or 'kaiser_fast').
+
+    """
+    def __init__(self, up, down, filter='kaiser_best'):
+        import numpy as np
+
+        self.up, self.down = up, down
+        self.filter = filter
+        zero_crossings = 64 if filter == 'kaiser_best' else 32
+        self.pad = int(np.ceil(zero_crossings*max(1., down/float(up))))
+
+    def __call__(self, x):
+        import resampy
+
+        return resampy.resample(x, self.down, self.up, filter=self.filter)
+
+    def n_out(self, n):
+        return int(n*float(self.up)/self.down)
+
+
+class DecimatingBackend(object):
+    """
+    Decimate by the integer factor q (PolyphaseBackend(1, q)) before the backend resampling by
+    up/down, for speed-ups too large to approximate with terms of at most max_terms. Acts as one
+    backend resampling by up/(q*down).
+
+    """
+    def __init__(self, q, backend, **options):
+        self.decimate = PolyphaseBackend(1, q, **options)
+        self.backend = backend
+        self.q = q
+        self.up, self.down = backend.up, q*backend.down
+        # the backend reaches its pad decimated samples, each reaching decimate.pad input samples
+        self.pad = self.decimate.pad + q*backend.pad
+
+    def __call__(self, x):
+        return self.backend(self.decimate(x))
+
+    def n_out(self, n):
+        return self.backend.n_out(self.decimate.n_out(n))
+
+
+class InterpolatingBackend(object):
+    """
+    Interpolate by the integer factor p (PolyphaseBackend(p, 1)) before the backend resampling by
+    up/down, for slow-downs too large to approximate with terms of at most max_terms. Acts as one
+    backend resampling by (p*up)/down.
+
+    """
+    def __init__(self, p, backend, **options):
+        self.interpolate = PolyphaseBackend(p, 1, **options)
+        self.backend = backend
+        self.p = p
+        self.up, self.down = p*backend.up, backend.down
+        # the backend reaches its pad interpolated samples, i.e. pad/p input samples, each reaching
+        # interpolate.pad input samples
+        self.pad = self.interpolate.pad + -(-backend.pad//p)
+
+    def __call__(self, x):
+        return self.backend(self.interpolate(x))
+
+    def n_out(self, n):
+        return self.backend.n_out(self.interpolate.n_out(n))
+
+
+# Backends by name: each is built with (up, down, **options) and resamples a whole array by
+# up/down when called. Add an entry here to plug in another resampler.
+BACKENDS = {
+    'poly': PolyphaseBackend,
+    'resampy': ResampyBackend,
+}
+
+# Backend and options for every quality setting, from fastest to most accurate
+QUALITY = {
+    'fast': {'poly': dict(zero_crossings=4, beta=5.0), 'resampy': dict(filter='kaiser_fast')},
+    'medium': {'poly': dict(zero_crossings=10, beta=5.0), 'resampy': dict(filter='kaiser_best')},
+    'best': {'poly': dict(zero_crossings=32, beta=8.6), 'resampy': dict(filter='kaiser_best')},
+}
+
+
+def rational_ratio(fs_in, fs_out, max_terms=1000):
+    """
+    Integers (up, down) with up/down closest to fs_out/fs_in and neither larger than max_terms,
+    which bounds the length of the polyphase filter. Ratios below 1/max_terms or above max_terms
+    cannot be approximated (see Resampler, which decimates or interpolates first) and raise a
+    ValueError.
+
+    """
+    ratio = Fraction(fs_out)/Fraction(fs_in)
+    if ratio > max_terms:
+        raise ValueError("fs_out/fs_in = %g is above max_terms = %d: interpolate first" % (ratio, max_terms))
+    if ratio >= 1:
+        inv = (1/ratio).limit_denominator(max_terms)
+        return inv.denominator, inv.numerator
+    if ratio*max_terms < 1:
+        raise ValueError("fs_out/fs_in = %g is below 1/max_terms = %g: decimate first" % (ratio, 1./max_terms))
+    ratio = ratio.limit_denominator(max_terms)
+    return ratio.numerator, ratio.denominator
+
+
+class Resampler(object):
+    """
+    Resample from fs_in to fs_out by the rational ratio up/down closest to fs_out/fs_in.
+    method is 'poly', 'resampy' or 'auto' (the polyphase filter, unless quality is 'best');
+    quality is 'fast', 'medium' or 'best'. Since up/down is only close to fs_out/fs_in, fs_in is
+    updated to fs_out*down/up, the rate the data actually plays back at. Speed-ups so large that
+    fs_out/fs_in < 10/max_terms first decimate by an integer factor (self.decim), and slow-downs
+    so large that fs_out/fs_in > max_terms/10 first interpolate by one (self.interp), so the
+    remaining ratio can still be approximated to well under 0.1% with terms up to max_terms.
+
+    """
+    def __init__(self, fs_in, fs_out, method='auto', quality='medium', max_terms=1000):
+        import numpy as np
+
+        if quality not in QUALITY:
+            raise ValueError("quality must be one of %s, got '%s'" % (sorted(QUALITY), quality))
+        if method == 'auto':
+            method = 'resampy' if quality == 'best' else 'poly'
+        if method not in BACKENDS:
+            raise ValueError("method must be 'auto' or one of %s, got '%s'" % (sorted(BACKENDS), method))
+        ratio = float(fs_out)/fs_in
+        self.decim = int(np.ceil(10./(ratio*max_terms))) if ratio*max_terms < 10 else 1
+        self.interp = int(np.ceil(10.*ratio/max_terms)) if 10.*ratio > max_terms else 1
+        up, down = rational_ratio(fs_in*float(self.interp)/self.decim, fs_out, max_terms)
+        self.fs_out = fs_out
+        self.method, self.quality = method, quality
+        self.backend = BACKENDS[method](up, down, **QUALITY[quality].get(method, {}))
+        if self.decim > 1:
+            self.backend = DecimatingBackend(self.decim, self.backend, **QUALITY[quality]['poly'])
+        if self.interp > 1:
+            self.backend = InterpolatingBackend(self.interp, self.backend, **QUALITY[quality]['poly'])
+        self.up, self.down = self.backend.up, self.backend.down
+        self.fs_in = fs_out*float(self.down)/self.up
+        # Input offsets must be multiples of down to land on whole output samples
+        self.pad = -(-self.backend.pad//self.down)*self.down
+        self.reset()
+
+    def __repr__(self):
+        return 'Resampler(%s, %s/%s, %s)' % (self.method, self.up, self.down, self.quality)
+
+    def resample(self, data):
+        """
+        Resample a whole array at once.
+
+        """
+        import numpy as np
+
+        return self.backend(np.asarray(data, dtype=np.float64))
+
+    def blocks(self, data, block_len=2**20, scale=1.):
+        """
+        Resample data*scale in overlapping blocks of about block_len input samples, read one at a time
+        (so data can be memory-mapped), and yield consecutive output blocks. The pad input samples on
+        either side of each block are resampled along with it and then discarded, which hides filter
+        edge effects: concatenating the output matches resampling the whole trace at once.
+
+        """
+        import numpy as np
+
+        up, down, pad = self.up, self.down, self.pad
+        block_len = max(-(-block_len//down), 1)*down
+        n = len(data)
+        n_out = self.backend.n_out(n)
+        for i0 in range(0, n, block_len):
+            i1 = min(i0+block_len, n)
+            j0, j1 = max(i0-pad, 0), min(i1+pad, n)
+            block = self.backend(np.asarray(data[j0:j1], dtype=np.float64)*scale)
+            k0 = (i0-j0)//down*up
+            k1 = k0 + (i1-i0)//down*up if i1 < n else n_out - j0//down*up
+            yield block[k0:k1]
+
+    def reset(self):
+        """
+        Forget the stream state kept by process.
+
+        """
+        import numpy as np
+
+        self._buf = np.zeros(0)
+        self._buf_start = 0  # input index of self._buf[0]
+        self._next = 0  # first input sample without output yet
+        self._n = 0  # input samples seen
+
+    def process(self, chunk, final=False):
+        """
+        Feed the next chunk of a stream and return the output samples that are now complete.
+        Output lags the input by the filter length; final=True flushes the rest and resets the state.
+        The concatenated output matches resampling the whole stream at once.
+
+        """
+        import numpy as np
+
+        up, down, pad = self.up, self.down, self.pad
+        self._buf = np.concatenate([self._buf, np.asarray(chunk, dtype=np.float64)])
+        self._n += len(chunk)
+        i0 = self._next
+        i1 = self._n if final else (self._n-pad)//down*down
+        if i1 <= i0:
+            if final:
+                self.reset()
+            return np.zeros(0)
+        j0, j1 = max(i0-pad, 0), min(i1+pad, self._n)
+        block = self.backend(self._buf[j0-self._buf_start:j1-self._buf_start])
+        k0 = (i0-j0)//down*up
+        k1 = k0 + (i1-i0)//down*up if not final else self.backend.n_out(self._n) - j0//down*up
+        if final:
+            self.reset()
+        else:
+            # keep only the input the next blocks still reach back to
+            keep = max(i1-pad, 0)
+            self._buf = self._buf[keep-self._buf_start:]
+            self._buf_start = keep
+            self._next = i1
+        return block[k0:k1]
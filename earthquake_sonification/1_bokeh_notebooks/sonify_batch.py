@@ -0,0 +1,182 @@
+# encoding: utf-8
+# Batch sonification for EI LIVE 2020:
+# Render many traces (e.g. every station/event in ../data) with AudioPlayerModel.sonify_plotwfspec,
+# spread over a pool of processes, writing one html page plus its audio file per trace.
+#
+# Usage from a notebook:
+#     import sonify_batch
+#     results = sonify_batch.sonify_batch(sonify_batch.default_manifest('../data'), 'batch_output', TargetDuration=30)
+#
+# or from the command line:
+#     python sonify_batch.py ../data batch_output --TargetDuration 30
+#
+# The pages load their audio (and any envelope chunks or spectrogram tiles) by URL, so view them
+# through a web server rather than as files: cd batch_output && python -m http.server 8000
+#
+import os
+import time
+
+
+def load_trace_csv(path):
+    """
+    Load a trace saved by 0_get_seismograms.ipynb (columns data, t, time).
+    Returns the data vector and its sample rate.
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = pd.read_csv(path, usecols=['data', 't'])
+    fs = 1./np.median(np.diff(df.t.values[:100]))
+    return df.data.values, fs
+
+
+def load_trace(path):
+    """
+    Load a trace from a csv file or from the binary format of trace_io (memory-mapped).
+    Returns the data vector and its sample rate.
+
+    """
+    if path.endswith('.csv'):
+        return load_trace_csv(path)
+    import trace_io
+    data, meta = trace_io.read_trace(path)
+    return data, meta['sampling_rate']
+
+
+def default_manifest(datadir, ext='.csv'):
+    """
+    One manifest item per trace in datadir (ext='.csv', or '.npy' for traces converted with
+    trace_io), with titles taken from the file names (e.g. MAJO_M9.1_BHZ.csv => 'MAJO M9.1 BHZ').
+
+    """
+    manifest = []
+    for fname in sorted(os.listdir(datadir)):
+        if not fname.endswith(ext):
+            continue
+        name = os.path.splitext(fname)[0]
+        manifest.append({'file': os.path.join(datadir, fname),
+                         'default_title': name,
+                         'title': name.replace('_', ' ')})
+    return manifest
+
+
+def read_manifest(path):
+    """
+    Read a manifest from a json file (list of objects) or a csv file (one row per trace).
+    Each item needs a 'file' and may override any sonify_plotwfspec option, e.g. TargetDuration.
+
+    """
+    import json
+    import pandas as pd
+
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f)
+    df = pd.read_csv(path)
+    return [{k: v for k, v in row.items() if not pd.isnull(v)} for row in df.to_dict('records')]
+
+
+def sonify_item(item, outdir, options):
+    """
+    Sonify and plot one manifest item, saving outdir/<default_title>.html and its audio file
+    in outdir/audio. Returns the item's timings (seconds) and output sizes (bytes).
+
+    """
+    from bokeh.embed import file_html
+    from bokeh.resources import CDN
+    import BokehAudioPlayer
+
+    opts = dict(options)
+    opts.update(item)
+    path = opts.pop('file')
+    default_title = opts.pop('default_title', os.path.splitext(os.path.basename(path))[0])
+    title = opts.pop('title', default_title)
+    data_scale = opts.pop('data_scale', 1e3)  # m => mm for the displacement axis
+    TargetDuration = opts.pop('TargetDuration')
+    audio_ext = opts.pop('audio_ext', '.wav')
+    fs = opts.pop('fs', None)
+
+    result = {'default_title': default_title, 'file': path}
+    t0 = time.perf_counter()
+    data, fs_file = load_trace(path)
+    fs = fs_file if fs is None else fs
+    t1 = time.perf_counter()
+    audio_file = os.path.join(outdir, 'audio', default_title + audio_ext)
+    grid = BokehAudioPlayer.AudioPlayerModel.sonify_plotwfspec(
+        data, fs, data, TargetDuration, default_title, title, data_dis_scale=data_scale,
+        audio_file=audio_file, audio_url='audio/' + default_title + audio_ext, **opts)
+    t2 = time.perf_counter()
+    html_file = os.path.join(outdir, default_title + '.html')
+    with open(html_file, 'w') as f:
+        f.write(file_html(grid, CDN, title))
+    t3 = time.perf_counter()
+
+    result.update(load_s=t1-t0, sonify_s=t2-t1, save_s=t3-t2, total_s=t3-t0,
+                  html_bytes=os.path.getsize(html_file), audio_bytes=os.path.getsize(audio_file))
+    return result
+
+
+def sonify_batch(manifest, outdir, processes=None, **options):
+    """
+    Sonify every item of manifest (see default_manifest and read_manifest) on a pool of
+    processes (one per core by default). options are passed to sonify_plotwfspec and can be
+    overridden per item. Returns one result per item in manifest order, with timings, or the
+    error message if the item failed.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not os.path.isdir(os.path.join(outdir, 'audio')):
+        os.makedirs(os.path.join(outdir, 'audio'))
+    if processes is None:
+        processes = os.cpu_count()
+
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(sonify_item, item, outdir, options) for item in manifest]
+        for item, future in zip(manifest, futures):
+            try:
+                results.append(future.result())
+            except Exception as err:
+                results.append({'default_title': item.get('default_title'), 'file': item['file'],
+                                'error': repr(err)})
+    return results
+
+
+def print_results(results):
+    for r in results:
+        if 'error' in r:
+            print('%-25s FAILED %s' % (r['default_title'], r['error']))
+        else:
+            print('%-25s load %6.2fs  sonify %6.2fs  save %6.2fs  total %6.2fs  html %8d B  audio %9d B' %
+                  (r['default_title'], r['load_s'], r['sonify_s'], r['save_s'], r['total_s'],
+                   r['html_bytes'], r['audio_bytes']))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sonify a batch of traces in parallel.')
+    parser.add_argument('manifest', help='data directory of trace csv files, or a manifest .csv/.json')
+    parser.add_argument('outdir', help='output directory for html pages and audio')
+    parser.add_argument('--TargetDuration', type=float, default=30, help='duration of sonified waveforms (s)')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--high_res_spec', action='store_true')
+    parser.add_argument('--spec_tile_size', type=int, default=None,
+                        help='store spectrograms as tiles of this many cells, loaded on zoom')
+    parser.add_argument('--cache_dir', default=None)
+    parser.add_argument('--resample_quality', default='medium', choices=['fast', 'medium', 'best'])
+    parser.add_argument('--ext', default='.csv', help='trace file type in a data directory (.csv or .npy)')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.manifest):
+        manifest = default_manifest(args.manifest, ext=args.ext)
+    else:
+        manifest = read_manifest(args.manifest)
+    t0 = time.perf_counter()
+    results = sonify_batch(manifest, args.outdir, processes=args.processes, TargetDuration=args.TargetDuration,
+                           high_res_spec=args.high_res_spec, spec_tile_size=args.spec_tile_size,
+                           cache_dir=args.cache_dir, resample_quality=args.resample_quality)
+    print_results(results)
+    print('%d traces in %.2fs' % (len(results), time.perf_counter()-t0))
@@ -0,0 +1,51 @@
+# encoding: utf-8
+# Offline tests of realtime_sonify.py, run from this folder with
+#
+#     python -m pytest test_realtime_sonify.py
+#
+import numpy as np
+import pytest
+
+import realtime_sonify
+
+
+@pytest.mark.parametrize('fs, speed', [(20., 1.), (40., 1.), (100., 1.), (1., 500.), (40., 50.)])
+def test_audio_rate(fs, speed):
+    fs_audio, packet_len = 44100, 64
+    proc = realtime_sonify.StreamProcessor(fs, speed, fs_audio=fs_audio)
+    data = np.random.RandomState(0).randn(int(200*fs)//packet_len*packet_len)
+    n_audio = 0
+    for i0 in range(0, len(data), packet_len):
+        n_audio += len(proc.process(i0/fs, data[i0:i0+packet_len])['audio'])
+    n_audio += len(proc.resampler.process(np.zeros(0), final=True))
+    # every input second makes fs_audio/speed output samples
+    assert abs(n_audio/(len(data)/fs) / (fs_audio/speed) - 1) < 1e-3
+
+
+def test_loop_without_gaps(tmp_path, monkeypatch):
+    import trace_io
+
+    fs, packet_len = 100., 64
+    data = np.random.RandomState(1).randn(1000)  # not a whole number of packets
+    trace_io.write_trace(str(tmp_path/'trace'), data, fs, '2020-01-01')
+    source = realtime_sonify.FileReplaySource(str(tmp_path/'trace.npy'), speed=1., packet_len=packet_len,
+                                              max_delay=1e9, loop=True)
+    now = [0.]
+    monkeypatch.setattr(realtime_sonify.time, 'monotonic', lambda: now[0])
+    source.poll()
+    now[0] = 2.5*len(data)/fs
+    packets = source.poll()
+    # every packet starts where the last one ended, and the samples wrap around to the start
+    t0 = np.array([t for t, packet in packets])
+    assert all(len(packet) == packet_len for t, packet in packets)
+    np.testing.assert_allclose(np.diff(t0), packet_len/fs)
+    n = len(packets)*packet_len
+    np.testing.assert_array_equal(np.concatenate([packet for t, packet in packets]), data[np.arange(n) % len(data)])
+
+    proc = realtime_sonify.StreamProcessor(fs, 1.)
+    resets = []
+    reset = proc.reset
+    monkeypatch.setattr(proc, 'reset', lambda t0=0.: (resets.append(t0), reset(t0)))
+    for t, packet in packets:
+        proc.process(t, packet)
+    assert resets == [0.]  # only the reset at the start of the stream
@@ -0,0 +1,42 @@
+# encoding: utf-8
+# Offline tests of resampling.py, run from this folder with
+#
+#     python -m pytest test_resampling.py
+#
+import numpy as np
+import pytest
+
+import resampling
+
+
+@pytest.mark.parametrize('method', ['poly', 'resampy'])
+@pytest.mark.parametrize('fs_in', [1., 10., 20., 30., 40., 25.2, 1000., 1e5, 1e6])
+def test_duration(fs_in, method):
+    if method == 'resampy':
+        pytest.importorskip('resampy')
+    r = resampling.Resampler(fs_in, 44100, method=method, quality='fast')
+    assert abs(r.fs_in/fs_in - 1) < 1e-3
+    data = np.random.RandomState(0).randn(int(20*fs_in))
+    out = r.resample(data)
+    # 20 s of data play for 20 s at the playback rate fs_in
+    assert abs(len(out)/44100. - len(data)/r.fs_in) < 1e-3
+
+
+@pytest.mark.parametrize('fs_in', [10., 40., 1e5])
+def test_blocks_match_whole(fs_in):
+    r = resampling.Resampler(fs_in, 44100, quality='fast')
+    data = np.random.RandomState(1).randn(int(20*fs_in))
+    whole = r.resample(data)
+    blocks = np.concatenate(list(r.blocks(data, block_len=len(data)//7)))
+    stream = [r.process(chunk) for chunk in np.array_split(data, 13)]
+    stream = np.concatenate(stream + [r.process(np.zeros(0), final=True)])
+    np.testing.assert_allclose(blocks, whole, atol=1e-9)
+    np.testing.assert_allclose(stream, whole, atol=1e-9)
+
+
+def test_rational_ratio_bounds():
+    assert resampling.rational_ratio(44100, 44100) == (1, 1)
+    with pytest.raises(ValueError):
+        resampling.rational_ratio(10, 44100)
+    with pytest.raises(ValueError):
+        resampling.rational_ratio(1e7, 1000)
@@ -0,0 +1,109 @@
+# encoding: utf-8
+# Binary storage of evenly sampled traces for EI LIVE 2020:
+# Samples are kept in a .npy file that can be memory-mapped, and the start time, sample rate and
+# column names are stored once in a .json file next to it, instead of a text csv with a time
+# string and a redundant t column on every row.
+#
+#     import trace_io
+#     trace_io.csv_to_trace('../data/MAJO_M9.1_BHZ.csv')  # => ../data/MAJO_M9.1_BHZ.npy + .json
+#     data, meta = trace_io.read_trace('../data/MAJO_M9.1_BHZ')  # data is memory-mapped
+#     grid = BokehAudioPlayer.AudioPlayerModel.sonify_plotwfspec(data, meta['sampling_rate'], ...,
+#                                                                 stream=True, lod_points=4000)
+#
+import json
+import os
+
+
+def _stem(path):
+    root, ext = os.path.splitext(path)
+    return root if ext in ('.npy', '.json', '.csv') else path
+
+
+def write_trace(path, data, sampling_rate, starttime, columns=None, **meta):
+    """
+    Save data (npts samples, or npts x ncols for several columns sharing one time axis) to
+    path.npy with its metadata in path.json. starttime is anything pandas.Timestamp understands.
+    Extra keyword arguments (e.g. station, units) are stored in the metadata.
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    stem = _stem(path)
+    data = np.asarray(data)
+    np.save(stem + '.npy', data)
+    meta.update(starttime=pd.Timestamp(starttime).isoformat(), sampling_rate=float(sampling_rate),
+                npts=int(data.shape[0]), dtype=data.dtype.str)
+    if columns is not None:
+        meta['columns'] = list(columns)
+    with open(stem + '.json', 'w') as f:
+        json.dump(meta, f, indent=1)
+    return stem
+
+
+def read_trace(path, mmap=True, column=None):
+    """
+    Load a trace saved by write_trace. Returns (data, meta).
+    With mmap=True the samples are memory-mapped, so only the parts actually used are read
+    from disk. column picks one column by name from a multi-column trace.
+
+    """
+    import numpy as np
+
+    stem = _stem(path)
+    with open(stem + '.json') as f:
+        meta = json.load(f)
+    data = np.load(stem + '.npy', mmap_mode='r' if mmap else None)
+    if column is not None:
+        data = data[:, meta['columns'].index(column)]
+    return data, meta
+
+
+def trace_times(meta, i0=0, i1=None):
+    """
+    Times of samples i0 to i1 of a trace, rebuilt from its start time and sample rate.
+
+    """
+    import pandas as pd
+
+    i1 = meta['npts'] if i1 is None else min(i1, meta['npts'])
+    start = pd.Timestamp(meta['starttime']) + pd.Timedelta(seconds=i0/meta['sampling_rate'])
+    return pd.date_range(start=start, periods=max(i1-i0, 0), freq=pd.Timedelta(seconds=1./meta['sampling_rate']))
+
+
+def csv_to_trace(csv_path, out_path=None, time_column=None, dtype='float64', **meta):
+    """
+    Convert a trace csv to the binary format. Handles both the event traces from
+    0_get_seismograms.ipynb (data, t, time) and the hourly noise series from
+    1_calc_daily_noise.ipynb (disp_avg, t_cent, daily_average): the first datetime-like
+    column (or time_column) gives the start time and sample rate, a t column is dropped,
+    and the remaining numeric columns are stored. Returns the output path stem.
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    if time_column is None:
+        time_column = [c for c in df.columns if c in ('time', 't_cent', 'Date')][0]
+    times = pd.to_datetime(df[time_column])
+    columns = [c for c in df.columns if c not in (time_column, 't')]
+    if 't' in df.columns:
+        sampling_rate = 1./np.median(np.diff(df.t.values))
+    else:
+        sampling_rate = 1./np.median(np.diff(times.values).astype('timedelta64[ns]').astype(np.float64)*1e-9)
+    data = df[columns].values.astype(dtype)
+    if len(columns) == 1:
+        data = data[:, 0]
+    starttime = times.iloc[0]
+    return write_trace(out_path if out_path is not None else csv_path, data, sampling_rate, starttime,
+                       columns=columns if len(columns) > 1 else None, source=os.path.basename(csv_path), **meta)
+
+
+def convert_dir(datadir, **meta):
+    """
+    Convert every csv file in datadir to the binary format. Returns the output path stems.
+
+    """
+    return [csv_to_trace(os.path.join(datadir, fname), **meta)
+            for fname in sorted(os.listdir(datadir)) if fname.endswith('.csv')]